@@ -0,0 +1,84 @@
+"""
+Bedrock Agent completion chunk 조립 방식 마이크로 벤치마크
+
+긴 한국어 응답을 임의 바이트 경계로 나눈 합성 chunk 에 대해 다음 방식을 비교한다.
+  - naive:       chunk 마다 decode 후 str += (기존 방식, 잘린 멀티바이트 문자에서 실패)
+  - incremental: 증분 디코더 + list/join (스트리밍 경로)
+  - bytearray:   bytearray 에 누적 후 한 번에 decode (버퍼링 경로)
+
+실행: python bench/bench_chunk_assembly.py [반복 횟수]
+"""
+import codecs
+import random
+import sys
+import timeit
+
+SAMPLE = "겨울 밤하늘 아래 하얀 눈이 소리 없이 내려앉고, 창가의 등불은 따뜻하게 흔들린다. "
+
+
+def make_chunks(total_chars, chunk_size, seed=0, aligned=False):
+    """chunk_size 바이트 내외로 나눈 chunk 목록 (aligned 이면 문자 경계에서만 자름)"""
+    text = (SAMPLE * (total_chars // len(SAMPLE) + 1))[:total_chars]
+    data = text if aligned else text.encode('utf-8')
+    step = max(1, chunk_size // 3) if aligned else chunk_size
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        size = max(1, int(step * rng.uniform(0.5, 1.5)))
+        chunk = data[pos:pos + size]
+        chunks.append(chunk.encode('utf-8') if aligned else chunk)
+        pos += size
+    return chunks
+
+
+def naive(chunks):
+    result = ""
+    for chunk in chunks:
+        result += chunk.decode('utf-8')
+    return result
+
+
+def incremental(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            parts.append(text)
+    parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts)
+
+
+def buffered(chunks):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+    return buffer.decode('utf-8')
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    for total_chars in (10_000, 100_000, 1_000_000):
+        for chunk_size in (16, 256):
+            chunks = make_chunks(total_chars, chunk_size)
+            expected = buffered(chunks)
+            print(f"chars={total_chars} chunk_bytes~{chunk_size} chunks={len(chunks)}")
+
+            for name, func in (('naive', naive), ('incremental', incremental), ('bytearray', buffered)):
+                target = chunks
+                label = ''
+                try:
+                    assert func(chunks) == expected
+                except UnicodeDecodeError:
+                    # 잘린 문자에서 실패하므로 문자 경계로 나눈 chunk 로 속도만 측정
+                    print(f"  {name:12s} UnicodeDecodeError (chunk 경계에서 잘린 문자)")
+                    target = make_chunks(total_chars, chunk_size, aligned=True)
+                    label = ' (문자 경계 chunk)'
+                elapsed = timeit.timeit(lambda: func(target), number=number) / number
+                print(f"  {name:12s} {elapsed * 1000:9.3f} ms{label}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+유량 제어 엔진별 Redis 메모리/명령 수 측정
+
+각 엔진으로 여러 API Key 에 대해 판정을 실행한 뒤, 활성 키당 MEMORY USAGE 와
+INFO commandstats 로 집계한 판정당 Redis 명령 수를 engine_profile 추정치와 함께 출력한다.
+측정용 Redis 의 데이터가 지워지므로 운영 클러스터에 실행하지 말 것.
+
+실행: python bench/bench_limiter_engines.py [redis://localhost:6379/15]
+"""
+import os
+import sys
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+import rate_limiter  # noqa: E402
+
+KEYS = 50
+
+
+def command_calls(redis_conn):
+    stats = redis_conn.info('commandstats')
+    return sum(
+        value['calls'] for name, value in stats.items()
+        if name not in ('cmdstat_evalsha', 'cmdstat_eval', 'cmdstat_info', 'cmdstat_script', 'cmdstat_flushdb')
+    )
+
+
+def run(redis_conn, engine, tier, decisions):
+    redis_conn.flushdb()
+    rate_limiter.DEFAULT_RATE_LIMIT_ENGINE = engine
+    rate_limiter.RATE_LIMIT_ENGINES = {}
+    rate_limiter._limiter_config = None
+    limit = rate_limiter.RATE_LIMITS[tier]
+
+    for i in range(KEYS):
+        redis_conn.set(f"user_tier:bench-{i}", tier)
+
+    before = command_calls(redis_conn)
+    started = time.perf_counter()
+    for _ in range(decisions):
+        for i in range(KEYS):
+            rate_limiter.check_rate_limit(redis_conn, f"bench-{i}", mode='two_stage')
+    elapsed = time.perf_counter() - started
+    ops = (command_calls(redis_conn) - before) / (decisions * KEYS)
+
+    memory = 0
+    for key in redis_conn.scan_iter(match='rate_limit:*'):
+        memory += redis_conn.memory_usage(key) or 0
+
+    profile = rate_limiter.engine_profile(engine, limit)
+    print(f"{engine:15s} {tier:10s} limit={limit:4d} "
+          f"memory/key={memory / KEYS:8.0f}B (est {profile['memory_bytes']:6d}B) "
+          f"ops/decision={ops:4.1f} (est {profile['ops_per_decision'] + 2}) "
+          f"latency={elapsed / (decisions * KEYS) * 1000:6.3f}ms")
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'redis://localhost:6379/15'
+    redis_conn = redis.Redis.from_url(url, decode_responses=True)
+
+    # print 출력 억제
+    rate_limiter.print = lambda *args, **kwargs: None
+
+    for tier in ('premium', 'enterprise'):
+        decisions = rate_limiter.RATE_LIMITS[tier]
+        for engine in rate_limiter.LIMITER_ENGINES:
+            run(redis_conn, engine, tier, decisions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+사용량 저장 방식별 Redis 메모리 측정 (legacy vs compact)
+
+API Key 여러 개가 30일 동안 매분 요청한 사용량을 각 방식으로 기록하되, 마지막 시점 기준으로 TTL 이
+지났을 키는 제외하여 정상 상태의 키 구성을 재현한 뒤 MEMORY USAGE 로 키당 메모리를 측정하고
+usage_memory_profile 추정치와 함께 출력한다.
+측정용 Redis 의 데이터가 지워지므로 운영 클러스터에 실행하지 말 것.
+
+실행: python bench/bench_usage_memory.py [redis://localhost:6379/15]
+"""
+import os
+import sys
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+import usage  # noqa: E402
+
+KEYS = 10
+DAYS = 30
+
+
+def steady_state_updates(api_key, end):
+    """end 시점에 살아 있을 키별 (필드 -> 증가량), TTL"""
+    counters = {}
+    for minute in range(DAYS * 1440):
+        current_time = end - minute * 60
+        for key, field, ttl in usage.usage_updates(api_key, current_time):
+            entry = counters.get(key)
+            if entry is None:
+                # 역순으로 순회하므로 처음 만난 시각이 마지막 기록 시각
+                if ttl and current_time + ttl <= end:
+                    continue
+                entry = counters[key] = ({}, ttl)
+            fields = entry[0]
+            fields[field] = fields.get(field, 0) + 1
+    return counters
+
+
+def run(redis_conn, schema):
+    redis_conn.flushdb()
+    usage.USAGE_SCHEMA = schema
+    end = int(time.time())
+
+    for i in range(KEYS):
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for key, (fields, ttl) in steady_state_updates(f"bench-{i}", end).items():
+                if None in fields:
+                    pipe.set(key, fields[None])
+                else:
+                    pipe.hset(key, mapping=fields)
+                if ttl:
+                    pipe.expire(key, ttl)
+            pipe.execute()
+
+    keys = memory = 0
+    for key in redis_conn.scan_iter(match='usage:*'):
+        keys += 1
+        memory += redis_conn.memory_usage(key) or 0
+
+    profile = usage.usage_memory_profile(schema)
+    print(f"{schema:8s} keys/api_key={keys / KEYS:6.1f} (est {profile['keys']:4d}) "
+          f"memory/api_key={memory / KEYS:8.0f}B (est {profile['memory_bytes']:6d}B) "
+          f"keys created/day={profile['keys_created_per_day']}")
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'redis://localhost:6379/15'
+    redis_conn = redis.Redis.from_url(url, decode_responses=True)
+
+    for schema in ('legacy', 'compact'):
+        run(redis_conn, schema)
+
+
+if __name__ == '__main__':
+    main()
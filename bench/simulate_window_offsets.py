@@ -0,0 +1,145 @@
+"""
+키별 윈도우 오프셋과 Retry-After jitter 의 재시도 집중 완화 시뮬레이션
+
+sliding_window 엔진의 판정과 다음 허용 시각 계산을 파이썬으로 재현하여 요청 로그를 재생하고,
+거부된 요청은 클라이언트가 Retry-After 후 재시도한다고 가정하여 초당 프록시 유입량의
+최대/평균 비율을 비교한다.
+  aligned:       모든 키가 분 경계에 정렬된 윈도우, X-Rate-Limit-Reset 까지 대기 후 재시도 (기존 동작)
+  aligned_retry: 정렬된 윈도우, 정확한 retry_after 후 재시도 (재시도 시각만의 효과)
+  offsets:       키 해시 윈도우 오프셋, 정확한 retry_after 후 재시도 (aligned_retry 대비 오프셋만의 효과)
+  jittered:      키 해시 윈도우 오프셋 + jitter 를 더한 Retry-After
+
+요청 로그는 "timestamp,api_key" 형식의 CSV 이며, 생략하면 분당 제한을 넘는 합성 트래픽을 만든다.
+
+실행: python bench/simulate_window_offsets.py [requests.csv]
+"""
+import collections
+import csv
+import heapq
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+import rate_limiter  # noqa: E402
+
+LIMIT = 10          # 키당 분당 제한
+WINDOW = rate_limiter.WINDOW_SIZE
+MAX_RETRIES = 5
+KEYS = 300
+DURATION = 600      # 합성 트래픽 길이(초)
+RATE_PER_KEY = 0.25 # 키당 초당 평균 요청 수 (분당 15건, 제한의 1.5배)
+
+# 시나리오 -> (키 해시 윈도우 오프셋 사용 여부, 재시도 시각: reset / retry_after / jitter)
+SCENARIOS = {
+    'aligned': (False, 'reset'),
+    'aligned_retry': (False, 'retry_after'),
+    'offsets': (True, 'retry_after'),
+    'jittered': (True, 'jitter')
+}
+
+
+def synthetic_traffic(seed=7):
+    rng = random.Random(seed)
+    requests = []
+    for i in range(KEYS):
+        t = rng.uniform(0, WINDOW)
+        while t < DURATION:
+            requests.append((t, f"key-{i}"))
+            t += rng.expovariate(RATE_PER_KEY)
+    return sorted(requests)
+
+
+def load_traffic(path):
+    with open(path, newline='') as f:
+        rows = [(float(row[0]), row[1]) for row in csv.reader(f) if row]
+    start = min(t for t, _ in rows)
+    return sorted((t - start, key) for t, key in rows)
+
+
+class SlidingWindow:
+    """admission 스크립트의 sliding_window 엔진과 같은 판정 (요청 1건 단위)"""
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+        self.counters = collections.defaultdict(int)
+
+    def check(self, key, now):
+        """(허용 여부, 윈도우 reset 시각, 다음 허용 가능 시각)"""
+        offset = rate_limiter.window_offset(f"rate_limit:{{{key}}}:") if self.offsets else 0
+        window_id = math.floor((now - offset) / WINDOW)
+        window_start = window_id * WINDOW + offset
+        current = self.counters[key, window_id]
+        prev = self.counters[key, window_id - 1]
+        estimated = math.floor(prev * (1 - (now - window_start) / WINDOW) + current + 1)
+        if estimated <= LIMIT:
+            self.counters[key, window_id] += 1
+            return True, window_start + WINDOW, now
+
+        if current + 1 <= LIMIT:
+            retry_at = window_start + WINDOW * (1 - (LIMIT - current - 1) / prev)
+        else:
+            retry_at = window_start + WINDOW * (2 - (LIMIT - 1) / current)
+        return False, window_start + WINDOW, retry_at
+
+
+def simulate(requests, scenario, seed=11):
+    offsets, retry = SCENARIOS[scenario]
+    rate_limiter.RATE_LIMIT_WINDOW_OFFSETS = offsets
+    random.seed(seed)
+    limiter = SlidingWindow(offsets=offsets)
+
+    events = [(t, key, 0) for t, key in requests]
+    heapq.heapify(events)
+    arrivals = collections.Counter()
+    admitted = denied = 0
+
+    while events:
+        now, key, attempt = heapq.heappop(events)
+        arrivals[int(now)] += 1
+        allowed, reset_time, retry_at = limiter.check(key, now)
+        if allowed:
+            admitted += 1
+            continue
+
+        denied += 1
+        if attempt >= MAX_RETRIES:
+            continue
+        if retry == 'reset':
+            delay = math.ceil(reset_time - now)
+        elif retry == 'retry_after':
+            delay = math.ceil(retry_at - now)
+        else:
+            delay = rate_limiter.jittered_retry_after(retry_at - now)
+        heapq.heappush(events, (now + max(delay, 1), key, attempt + 1))
+
+    seconds = range(WINDOW, max(arrivals) + 1)  # 첫 윈도우(워밍업) 제외
+    load = [arrivals[s] for s in seconds]
+    mean = sum(load) / len(load)
+    p99 = sorted(load)[int(len(load) * 0.99)]
+    return {
+        'scenario': scenario,
+        'mean': mean,
+        'peak': max(load),
+        'peak_to_mean': max(load) / mean,
+        'p99_to_mean': p99 / mean,
+        'admitted': admitted,
+        'denied': denied
+    }
+
+
+def main():
+    requests = load_traffic(sys.argv[1]) if len(sys.argv) > 1 else synthetic_traffic()
+    print(f"requests={len(requests)} keys={len({key for _, key in requests})} limit={LIMIT}/min")
+
+    for scenario in SCENARIOS:
+        result = simulate(requests, scenario)
+        print(f"{result['scenario']:13s} mean={result['mean']:7.1f}/s peak={result['peak']:5d}/s "
+              f"peak/mean={result['peak_to_mean']:5.2f} p99/mean={result['p99_to_mean']:5.2f} "
+              f"admitted={result['admitted']} denied={result['denied']}")
+
+
+if __name__ == '__main__':
+    main()
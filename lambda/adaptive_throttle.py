@@ -0,0 +1,155 @@
+import os
+import uuid
+
+from botocore.exceptions import ClientError
+
+# 계정 전체 Bedrock 호출 동시성 적응 제어 (AIMD, 기본 비활성화)
+# 모든 컨테이너가 Redis 의 공유 동시성 윈도우를 사용하며, 정상 응답마다 윈도우를 조금씩 늘리고
+# 스로틀링(또는 지연 목표 초과) 시 절반으로 줄여 서비스 쿼터 바로 아래에서 수렴하게 한다.
+ADAPTIVE_THROTTLE_ENABLED = os.environ.get('ADAPTIVE_THROTTLE_ENABLED', 'false').lower() == 'true'
+ADAPTIVE_THROTTLE_INITIAL = float(os.environ.get('ADAPTIVE_THROTTLE_INITIAL', 10))
+ADAPTIVE_THROTTLE_MIN = float(os.environ.get('ADAPTIVE_THROTTLE_MIN', 1))
+ADAPTIVE_THROTTLE_MAX = float(os.environ.get('ADAPTIVE_THROTTLE_MAX', 100))
+ADAPTIVE_THROTTLE_INCREASE = float(os.environ.get('ADAPTIVE_THROTTLE_INCREASE', 1))    # 윈도우 1회분 응답당 증가량
+ADAPTIVE_THROTTLE_DECREASE = float(os.environ.get('ADAPTIVE_THROTTLE_DECREASE', 0.5))  # 혼잡 시 곱할 비율
+ADAPTIVE_THROTTLE_COOLDOWN = float(os.environ.get('ADAPTIVE_THROTTLE_COOLDOWN', 2))    # 연속 감소 최소 간격(초)
+# 첫 chunk 까지의 지연 목표(초), 초과 시 스로틀링과 같이 감소 (0 이면 지연은 보지 않음)
+ADAPTIVE_THROTTLE_LATENCY_TARGET = float(os.environ.get('ADAPTIVE_THROTTLE_LATENCY_TARGET', 0))
+# 호출별 슬롯 임대 시간(초): 컨테이너가 반환 없이 종료되어도 이 시간이 지나면 회수됨
+ADAPTIVE_THROTTLE_SLOT_TTL = float(os.environ.get('ADAPTIVE_THROTTLE_SLOT_TTL', 35))
+
+STATE_KEY = 'bedrock_throttle:state'
+IN_FLIGHT_KEY = 'bedrock_throttle:in_flight'
+
+# Bedrock 스로틀링으로 보는 오류 코드 (이벤트 스트림 오류는 소문자로 시작)
+THROTTLING_CODES = {'throttlingexception', 'servicequotaexceededexception', 'toomanyrequestsexception'}
+
+# KEYS[1]: 윈도우 상태 해시, KEYS[2]: 진행 중 호출 sorted set (member: 슬롯 ID, score: 임대 만료 시각)
+# ARGV[1]: 슬롯 ID, ARGV[2]: 임대 시간(초), ARGV[3]: 초기 윈도우
+# 반환: {acquired, in_flight, window}
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local window = math.floor(tonumber(redis.call('HGET', KEYS[1], 'window') or ARGV[3]))
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local in_flight = redis.call('ZCARD', KEYS[2])
+if in_flight >= window then
+    return {0, in_flight, window}
+end
+
+local ttl = tonumber(ARGV[2])
+redis.call('ZADD', KEYS[2], now + ttl, ARGV[1])
+redis.call('EXPIRE', KEYS[2], math.ceil(ttl))
+return {1, in_flight + 1, window}
+"""
+
+# 슬롯 반환과 AIMD 윈도우 조정
+# KEYS[1]: 윈도우 상태 해시, KEYS[2]: 진행 중 호출 sorted set
+# ARGV[1]: 슬롯 ID, ARGV[2]: 스로틀링 여부(1/0), ARGV[3]: 첫 chunk 지연(초, 음수면 측정 안 됨),
+# ARGV[4..10]: 초기/최소/최대 윈도우, 증가량, 감소 비율, 감소 간격, 지연 목표
+# 반환: 조정 후 윈도우 (문자열)
+FEEDBACK_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+
+local throttled = ARGV[2] == '1'
+local latency = tonumber(ARGV[3])
+local initial, min_window, max_window = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local increase, decrease = tonumber(ARGV[7]), tonumber(ARGV[8])
+local cooldown, latency_target = tonumber(ARGV[9]), tonumber(ARGV[10])
+
+local state = redis.call('HMGET', KEYS[1], 'window', 'decreased_at')
+local window = tonumber(state[1]) or initial
+local decreased_at = tonumber(state[2]) or 0
+
+if throttled or (latency_target > 0 and latency > latency_target) then
+    -- 같은 혼잡 구간에서 동시에 실패한 호출들이 윈도우를 반복해서 줄이지 않도록 감소 간격 적용
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    if now - decreased_at >= cooldown then
+        window = math.max(min_window, window * decrease)
+        redis.call('HSET', KEYS[1], 'window', string.format('%.4f', window), 'decreased_at', string.format('%.6f', now))
+    end
+elseif latency >= 0 then
+    -- 윈도우 크기만큼 응답이 성공하면 increase 만큼 증가
+    window = math.min(max_window, window + increase / window)
+    redis.call('HSET', KEYS[1], 'window', string.format('%.4f', window))
+end
+return string.format('%.4f', window)
+"""
+
+_acquire_script = None
+_feedback_script = None
+
+
+class AdaptiveThrottleExceeded(Exception):
+    """계정 전체 Bedrock 동시성 윈도우가 가득 참"""
+
+
+def is_throttling_error(error):
+    """Bedrock 스로틀링 오류인지 (래핑된 예외는 원인 예외로 판단)"""
+    error = error.__cause__ or error
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code.lower() in THROTTLING_CODES or status == 429
+    return False
+
+
+def acquire_bedrock_slot(redis_conn):
+    """
+    Bedrock 호출 슬롯 획득 -> 슬롯 ID (비활성화 또는 Redis 오류 시 None)
+
+    공유 윈도우가 가득 차 있으면 AdaptiveThrottleExceeded 를 발생시킨다.
+    """
+    if not ADAPTIVE_THROTTLE_ENABLED:
+        return None
+
+    global _acquire_script
+    slot = uuid.uuid4().hex
+    try:
+        if _acquire_script is None:
+            _acquire_script = redis_conn.register_script(ACQUIRE_SCRIPT)
+        acquired, in_flight, window = _acquire_script(
+            keys=[STATE_KEY, IN_FLIGHT_KEY],
+            args=[slot, ADAPTIVE_THROTTLE_SLOT_TTL, ADAPTIVE_THROTTLE_INITIAL],
+            client=redis_conn
+        )
+    except Exception as e:
+        print(f"Adaptive throttle acquire error: {str(e)}")
+        # Redis 오류시 기본적으로 허용 (fallback)
+        return None
+
+    if not acquired:
+        print(f"adaptive throttle full in_flight={in_flight} window={window}")
+        raise AdaptiveThrottleExceeded(f"Bedrock concurrency window full ({in_flight}/{window})")
+    return slot
+
+
+def release_bedrock_slot(redis_conn, slot, throttled=False, latency=None):
+    """
+    Bedrock 호출 슬롯 반환과 윈도우 조정
+
+    throttled 이면 윈도우를 줄이고, 첫 chunk 지연(latency)이 측정된 정상 호출이면 늘린다.
+    둘 다 아니면 (호출 도중 중단 등) 슬롯만 반환한다.
+    """
+    if slot is None:
+        return
+
+    global _feedback_script
+    try:
+        if _feedback_script is None:
+            _feedback_script = redis_conn.register_script(FEEDBACK_SCRIPT)
+        window = _feedback_script(
+            keys=[STATE_KEY, IN_FLIGHT_KEY],
+            args=[
+                slot, 1 if throttled else 0, -1 if latency is None else latency,
+                ADAPTIVE_THROTTLE_INITIAL, ADAPTIVE_THROTTLE_MIN, ADAPTIVE_THROTTLE_MAX,
+                ADAPTIVE_THROTTLE_INCREASE, ADAPTIVE_THROTTLE_DECREASE,
+                ADAPTIVE_THROTTLE_COOLDOWN, ADAPTIVE_THROTTLE_LATENCY_TARGET
+            ],
+            client=redis_conn
+        )
+        print(f"adaptive throttle window={window} throttled={throttled} latency={latency}")
+    except Exception as e:
+        print(f"Adaptive throttle feedback error: {str(e)}")
@@ -0,0 +1,60 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# 응답 결정과 무관한 Redis 기록 작업(사용량, 캐시 저장, 정산 등)을 Bedrock 호출과 동시에 실행하는 스레드 수
+# 0 이면 호출한 스레드에서 바로 실행
+BOOKKEEPING_WORKERS = int(os.environ.get('BOOKKEEPING_WORKERS', 2))
+# 응답 반환 전 기록 작업을 기다리는 최대 시간(초), 초과한 작업은 오류로 보고하고 응답은 그대로 반환
+BOOKKEEPING_JOIN_TIMEOUT = float(os.environ.get('BOOKKEEPING_JOIN_TIMEOUT', 2))
+
+# 컨테이너당 한 번 생성되어 warm 호출 간에 재사용
+_executor = None
+
+
+class _Completed:
+    """스레드 없이 실행한 작업의 결과 (Future 와 같은 방식으로 join)"""
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+
+    def done(self):
+        return True
+
+    def exception(self):
+        return self.error
+
+
+def run_in_background(fn, *args):
+    """
+    기록 작업 제출 -> join_background 에 전달할 작업 핸들
+
+    작업의 예외는 요청을 실패시키지 않고 join_background 에서 보고된다.
+    """
+    global _executor
+    if BOOKKEEPING_WORKERS <= 0:
+        try:
+            fn(*args)
+            return _Completed(fn.__name__)
+        except Exception as e:
+            return _Completed(fn.__name__, e)
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BOOKKEEPING_WORKERS, thread_name_prefix='bookkeeping')
+    future = _executor.submit(fn, *args)
+    future.name = fn.__name__
+    return future
+
+
+def join_background(tasks, timeout=None):
+    """응답 반환 전 기록 작업 완료 대기, 실패하거나 시간 내에 끝나지 않은 작업은 로그로 보고"""
+    pending = [task for task in tasks if not task.done()]
+    if pending:
+        wait(pending, timeout=BOOKKEEPING_JOIN_TIMEOUT if timeout is None else timeout)
+
+    for task in tasks:
+        if not task.done():
+            print(f"Bookkeeping timeout: {task.name}")
+        elif task.exception() is not None:
+            print(f"Bookkeeping error: {task.name}: {str(task.exception())}")
+    tasks.clear()
@@ -0,0 +1,97 @@
+import json
+import os
+import uuid
+
+# 등급별 API Key 동시 요청 제한 (예: {"free": 2, "premium": 10, "enterprise": 50}), 0 이면 제한 없음
+CONCURRENCY_LIMITS = json.loads(os.environ.get('CONCURRENCY_LIMITS', '{}'))
+DEFAULT_CONCURRENCY_LIMIT = int(os.environ.get('DEFAULT_CONCURRENCY_LIMIT', 0))
+
+# 요청별 슬롯 임대 시간(초): 컨테이너가 release 없이 종료되어도 이 시간이 지나면 슬롯이 회수됨
+CONCURRENCY_LEASE_TTL = float(os.environ.get('CONCURRENCY_LEASE_TTL', 35))
+
+_CONCURRENCY_LIMITS_JSON = json.dumps(CONCURRENCY_LIMITS)
+
+# Redis sorted set 기반 세마포어 (member: 요청 ID, score: 임대 만료 시각)
+# KEYS[1]: 사용자 등급 키, KEYS[2]: 세마포어 키
+# ARGV[1]: 요청 ID, ARGV[2]: 임대 시간(초), ARGV[3]: 기본 제한, ARGV[4]: 등급별 제한 JSON
+# 반환: {acquired, in_flight, limit}
+ACQUIRE_SCRIPT = """
+local limits = cjson.decode(ARGV[4])
+local tier = redis.call('GET', KEYS[1]) or 'free'
+local limit = tonumber(limits[tier] or ARGV[3])
+if limit <= 0 then
+    return {1, 0, 0}
+end
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local ttl = tonumber(ARGV[2])
+
+-- 만료된 임대(종료된 컨테이너의 요청) 회수
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local in_flight = redis.call('ZCARD', KEYS[2])
+if in_flight >= limit then
+    return {0, in_flight, limit}
+end
+
+redis.call('ZADD', KEYS[2], now + ttl, ARGV[1])
+-- 키 만료는 가장 늦게 끝나는 임대에 맞춤 (남은 시간이 짧은 요청이 진행 중인 다른 임대보다 먼저 키를 만료시키지 않도록)
+local latest = redis.call('ZRANGE', KEYS[2], -1, -1, 'WITHSCORES')
+redis.call('EXPIRE', KEYS[2], math.ceil(tonumber(latest[2]) - now))
+return {1, in_flight + 1, limit}
+"""
+
+_acquire_script = None
+
+
+def is_concurrency_limited():
+    """설정된 동시 요청 제한이 하나도 없으면 Redis 호출 생략"""
+    return DEFAULT_CONCURRENCY_LIMIT > 0 or any(limit > 0 for limit in CONCURRENCY_LIMITS.values())
+
+
+def _semaphore_key(api_key):
+    return f"concurrency:{{{api_key}}}"
+
+
+def acquire_concurrency_slot(redis_conn, api_key, lease_ttl=None):
+    """
+    동시 요청 슬롯 획득 -> {'acquired', 'slot', 'in_flight', 'limit'}
+
+    slot 은 release_concurrency_slot 에 전달할 요청 ID 이며, 제한이 없거나 Redis 오류 시에는
+    허용하고 slot 을 None 으로 반환한다.
+    """
+    if not is_concurrency_limited():
+        return {'acquired': True, 'slot': None, 'in_flight': 0, 'limit': 0}
+
+    global _acquire_script
+    slot = uuid.uuid4().hex
+    try:
+        if _acquire_script is None:
+            _acquire_script = redis_conn.register_script(ACQUIRE_SCRIPT)
+        acquired, in_flight, limit = _acquire_script(
+            keys=[f"user_tier:{api_key}", _semaphore_key(api_key)],
+            args=[slot, lease_ttl or CONCURRENCY_LEASE_TTL, DEFAULT_CONCURRENCY_LIMIT, _CONCURRENCY_LIMITS_JSON],
+            client=redis_conn
+        )
+    except Exception as e:
+        print(f"Concurrency limit error: {str(e)}")
+        # Redis 오류시 기본적으로 허용 (fallback)
+        return {'acquired': True, 'slot': None, 'in_flight': 0, 'limit': 0}
+
+    print(f"concurrency acquired={acquired} in_flight={in_flight} limit={limit}")
+    return {
+        'acquired': bool(acquired),
+        'slot': slot if acquired and limit > 0 else None,
+        'in_flight': in_flight,
+        'limit': limit
+    }
+
+
+def release_concurrency_slot(redis_conn, api_key, slot):
+    """동시 요청 슬롯 반환"""
+    if slot is None:
+        return
+    try:
+        redis_conn.zrem(_semaphore_key(api_key), slot)
+    except Exception as e:
+        print(f"Concurrency release error: {str(e)}")
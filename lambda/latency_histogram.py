@@ -0,0 +1,108 @@
+import math
+import os
+import time
+from datetime import datetime
+
+from usage import record_counters
+
+# 지연 히스토그램 설정 (기본 비활성화)
+LATENCY_HISTOGRAM_ENABLED = os.environ.get('LATENCY_HISTOGRAM_ENABLED', 'false').lower() == 'true'
+LATENCY_HISTOGRAM_TTL = int(os.environ.get('LATENCY_HISTOGRAM_TTL', 86400 * 7))
+
+# 로그 스케일 고정 버킷: 버킷 i 는 (MIN_MS * GROWTH^(i-1), MIN_MS * GROWTH^i] ms 구간
+# 백분위는 버킷 상한으로 계산하므로 GROWTH 1.25 면 최대 25% 과대 추정되며, 1ms ~ 약 137s 가 54개 버킷에 들어가
+# 시간당 해시 하나가 작은 정수 필드만 가져 listpack 으로 저장된다.
+LATENCY_HISTOGRAM_MIN_MS = 1.0
+LATENCY_HISTOGRAM_GROWTH = 1.25
+LATENCY_HISTOGRAM_BUCKETS = 54
+
+# 기록 지표: 전체 응답 지연, Bedrock 첫 chunk 까지의 지연, Bedrock 호출 전체 시간
+LATENCY_METRICS = ('total', 'ttfc', 'bedrock')
+
+_LOG_GROWTH = math.log(LATENCY_HISTOGRAM_GROWTH)
+
+
+def latency_bucket(latency):
+    """지연(초) -> 버킷 번호 (0 은 MIN_MS 이하, 마지막 버킷은 그 이상 전부)"""
+    ms = latency * 1000
+    if ms <= LATENCY_HISTOGRAM_MIN_MS:
+        return 0
+    bucket = math.ceil(math.log(ms / LATENCY_HISTOGRAM_MIN_MS) / _LOG_GROWTH - 1e-9)
+    return min(bucket, LATENCY_HISTOGRAM_BUCKETS - 1)
+
+
+def bucket_upper_ms(bucket):
+    """버킷 상한(ms)"""
+    return LATENCY_HISTOGRAM_MIN_MS * LATENCY_HISTOGRAM_GROWTH ** bucket
+
+
+def _histogram_key(scope, metric, hour_key):
+    return f"latency:{scope}:{metric}:{hour_key}"
+
+
+def _scopes(api_key, agent_id):
+    scopes = [f"key:{{{api_key}}}"]
+    if agent_id:
+        scopes.append(f"agent:{agent_id}")
+    return scopes
+
+
+def record_latency(redis_conn, api_key, agent_id, latencies):
+    """
+    지연 히스토그램 기록 ({지표: 초}, 값이 None 인 지표는 제외)
+
+    API Key 별, agentId 별 시간 단위 해시의 버킷 필드를 HINCRBY 로 증가시킨다.
+    사용량과 같은 경로로 기록되므로 지연 기록이면 함께 모아서 기록된다.
+    """
+    if not LATENCY_HISTOGRAM_ENABLED:
+        return
+
+    hour_key = datetime.utcfromtimestamp(int(time.time())).strftime('%Y-%m-%d:%H')
+    updates = [
+        (_histogram_key(scope, metric, hour_key), str(latency_bucket(latency)), 1, LATENCY_HISTOGRAM_TTL)
+        for metric, latency in latencies.items() if latency is not None
+        for scope in _scopes(api_key, agent_id)
+    ]
+    if updates:
+        record_counters(redis_conn, updates)
+
+
+def histogram_percentiles(counts, percentiles=(50, 90, 99)):
+    """버킷 분포 {버킷: 건수} -> {'count', 'p50', ...} (백분위는 해당 버킷 상한 ms, 데이터 없으면 None)"""
+    total = sum(counts.values())
+    result = {'count': total}
+    buckets = sorted(counts)
+    for p in percentiles:
+        result[f'p{p}'] = None
+        if not total:
+            continue
+        rank = math.ceil(total * p / 100)
+        seen = 0
+        for bucket in buckets:
+            seen += counts[bucket]
+            if seen >= rank:
+                result[f'p{p}'] = round(bucket_upper_ms(bucket), 1)
+                break
+    return result
+
+
+def get_latency_percentiles(redis_conn, metric, date, hour=None, api_key=None, agent_id=None,
+                            percentiles=(50, 90, 99)):
+    """
+    시간 단위(hour 생략 시 하루 전체 합산) 지연 백분위 조회
+
+    api_key 또는 agent_id 중 하나로 범위를 지정한다. 예: get_latency_percentiles(r, 'ttfc', '2024-01-01', 9, agent_id='GBEBGHJOE1')
+    """
+    scope = f"key:{{{api_key}}}" if api_key is not None else f"agent:{agent_id}"
+    hours = [hour] if hour is not None else range(24)
+
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for h in hours:
+            pipe.hgetall(_histogram_key(scope, metric, f"{date}:{h:02d}"))
+        hashes = pipe.execute()
+
+    counts = {}
+    for values in hashes:
+        for bucket, count in values.items():
+            counts[int(bucket)] = counts.get(int(bucket), 0) + int(count)
+    return histogram_percentiles(counts, percentiles)
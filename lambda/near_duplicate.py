@@ -0,0 +1,203 @@
+import json
+import os
+import random
+import time
+import unicodedata
+import zlib
+
+from response_cache import RESPONSE_CACHE_MAX_BYTES, cache_ttl, prompt_hash
+
+# 유사 프롬프트 캐시 설정 (기본 비활성화)
+NEAR_DUPLICATE_ENABLED = os.environ.get('NEAR_DUPLICATE_ENABLED', 'false').lower() == 'true'
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.8))
+NEAR_DUPLICATE_NGRAM = int(os.environ.get('NEAR_DUPLICATE_NGRAM', 3))
+NEAR_DUPLICATE_MAX_CANDIDATES = int(os.environ.get('NEAR_DUPLICATE_MAX_CANDIDATES', 32))
+# band 버킷당 보관할 최대 항목 수 (만료가 늦은 항목부터 유지)
+NEAR_DUPLICATE_MAX_BUCKET = int(os.environ.get('NEAR_DUPLICATE_MAX_BUCKET', 64))
+# 유사 판정 대상 최대 입력 길이(문자): MinHash 계산은 순수 Python 으로 입력 길이에 비례하므로 더 긴 입력은
+# 정확히 일치하는 캐시만 사용한다 (앞부분만 잘라 비교하면 끝부분만 다른 프롬프트를 같은 것으로 판정할 수 있음)
+NEAR_DUPLICATE_MAX_CHARS = int(os.environ.get('NEAR_DUPLICATE_MAX_CHARS', 2000))
+
+# agentId 별 Jaccard 유사도 임계값 (예: {"GBEBGHJOE1": 0.9})
+NEAR_DUPLICATE_THRESHOLDS = json.loads(os.environ.get('NEAR_DUPLICATE_THRESHOLDS', '{}'))
+
+# MinHash 시그니처 64개를 16 band x 4 row 로 나눔 (후보 검출 임계값 약 0.5)
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# 순열 해시 h(x) = (a * x + b) mod p 계수 (컨테이너 간 동일해야 하므로 고정 seed)
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = 0xffffffff
+_rng = random.Random(20240101)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+
+def shingle_hashes(input_text):
+    """
+    문자 n-gram 해시 집합
+
+    NFC 정규화 후 소문자로 바꾸고 문장부호/공백을 제거하여, 부호나 띄어쓰기만 다른
+    프롬프트가 같은 shingle 을 갖도록 한다.
+    """
+    text = ''.join(ch for ch in unicodedata.normalize('NFC', input_text).lower() if ch.isalnum())
+    n = NEAR_DUPLICATE_NGRAM
+    if len(text) <= n:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + n].encode('utf-8')) for i in range(len(text) - n + 1)}
+
+
+def minhash_signature(hashes):
+    """
+    MinHash 시그니처 (NUM_PERM 개의 32비트 값)
+
+    shingle 해시를 한 번만 계산해 두고 순열마다 내장 min/제너레이터로 최소값을 구한다.
+    외부 임베딩 모델이나 numpy 없이 순수 CPU 로 계산된다.
+    """
+    values = list(hashes)
+    return [
+        min((a * h + b) % _MERSENNE_PRIME for h in values) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def encode_signature(signature):
+    return ''.join(f'{v:08x}' for v in signature)
+
+
+def estimate_similarity(encoded_a, encoded_b):
+    """두 시그니처의 일치 비율 (Jaccard 유사도 추정치)"""
+    matches = sum(
+        1 for i in range(0, NUM_PERM * 8, 8)
+        if encoded_a[i:i + 8] == encoded_b[i:i + 8]
+    )
+    return matches / NUM_PERM
+
+
+def request_signature(agent_request):
+    """
+    요청의 인코딩된 MinHash 시그니처
+
+    요청 dict 에 보관하여 조회 시 계산한 시그니처를 Bedrock 응답 저장 시 다시 계산하지 않는다.
+    """
+    if 'minhashSignature' not in agent_request:
+        agent_request['minhashSignature'] = encode_signature(
+            minhash_signature(shingle_hashes(agent_request['inputText'])))
+    return agent_request['minhashSignature']
+
+
+def _scope(agent_request):
+    return f"{agent_request['agentId']}:{agent_request['agentAliasId']}"
+
+
+def _band_keys(agent_request, encoded):
+    """band 버킷 키 (sorted set, member: 항목 ID, score: 항목 만료 시각)"""
+    scope = _scope(agent_request)
+    width = ROWS * 8
+    return [
+        f"near_dup:bucket:{scope}:{band}:{encoded[band * width:(band + 1) * width]}"
+        for band in range(BANDS)
+    ]
+
+
+def _entry_key(agent_request, entry_id):
+    return f"near_dup:entry:{_scope(agent_request)}:{entry_id}"
+
+
+def similarity_threshold(agent_id):
+    return float(NEAR_DUPLICATE_THRESHOLDS.get(agent_id, NEAR_DUPLICATE_THRESHOLD))
+
+
+def is_near_duplicate_enabled(agent_request):
+    """sessionId 를 지정한 요청, NEAR_DUPLICATE_MAX_CHARS 보다 긴 입력, 캐시 TTL 이 0 인 Agent 는 제외"""
+    if not NEAR_DUPLICATE_ENABLED or agent_request.get('explicitSession'):
+        return False
+    if len(agent_request['inputText']) > NEAR_DUPLICATE_MAX_CHARS:
+        return False
+    return cache_ttl(agent_request['agentId']) > 0
+
+
+def find_similar_response(redis_conn, agent_request):
+    """
+    유사 프롬프트의 캐시된 응답 조회 -> (응답 텍스트 또는 None, 유사도)
+
+    LSH band 버킷에서 만료되지 않은 후보를 모아 일치하는 band 가 많은 순으로 NEAR_DUPLICATE_MAX_CANDIDATES 개를
+    고른 뒤 시그니처로 Jaccard 유사도를 추정하고, Agent 별 임계값 이상인 가장 유사한 항목의 응답을 반환한다.
+    """
+    if not is_near_duplicate_enabled(agent_request):
+        return None, 0.0
+
+    try:
+        encoded = request_signature(agent_request)
+        now = time.time()
+
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for key in _band_keys(agent_request, encoded):
+                pipe.zrangebyscore(key, now, '+inf')
+            band_hits = {}
+            for members in pipe.execute():
+                for entry_id in members:
+                    band_hits[entry_id] = band_hits.get(entry_id, 0) + 1
+
+        if not band_hits:
+            return None, 0.0
+
+        candidates = sorted(band_hits, key=band_hits.get, reverse=True)[:NEAR_DUPLICATE_MAX_CANDIDATES]
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for entry_id in candidates:
+                pipe.hget(_entry_key(agent_request, entry_id), 'sig')
+            signatures = pipe.execute()
+
+        best_id, best_similarity = None, 0.0
+        for entry_id, signature in zip(candidates, signatures):
+            if signature is None:
+                continue  # 만료된 항목
+            similarity = estimate_similarity(encoded, signature)
+            if similarity > best_similarity:
+                best_id, best_similarity = entry_id, similarity
+
+        if best_id is None or best_similarity < similarity_threshold(agent_request['agentId']):
+            return None, best_similarity
+
+        response_text = redis_conn.hget(_entry_key(agent_request, best_id), 'response')
+        return response_text, best_similarity
+
+    except Exception as e:
+        print(f"Near duplicate lookup error: {str(e)}")
+        return None, 0.0
+
+
+def index_similar_response(redis_conn, agent_request, response_text):
+    """
+    응답과 MinHash 시그니처 저장, LSH band 버킷에 등록
+
+    버킷은 항목 만료 시각을 score 로 갖는 sorted set 이며, 등록할 때마다 만료된 항목을 지우고
+    NEAR_DUPLICATE_MAX_BUCKET 개를 넘는 오래된 항목을 정리하여 자주 쓰이는 버킷도 크기가 제한된다.
+    """
+    if not is_near_duplicate_enabled(agent_request):
+        return
+    if len(response_text.encode('utf-8')) > RESPONSE_CACHE_MAX_BYTES:
+        return
+
+    try:
+        encoded = request_signature(agent_request)
+        entry_id = prompt_hash(agent_request)
+        entry_key = _entry_key(agent_request, entry_id)
+        ttl = cache_ttl(agent_request['agentId'])
+        now = time.time()
+
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.hset(entry_key, mapping={'sig': encoded, 'response': response_text})
+            pipe.expire(entry_key, ttl)
+            for key in _band_keys(agent_request, encoded):
+                pipe.zadd(key, {entry_id: now + ttl})
+                pipe.zremrangebyscore(key, '-inf', now)
+                pipe.zremrangebyrank(key, 0, -NEAR_DUPLICATE_MAX_BUCKET - 1)
+                pipe.expire(key, ttl)
+            pipe.execute()
+
+    except Exception as e:
+        print(f"Near duplicate index error: {str(e)}")
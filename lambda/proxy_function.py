@@ -1,247 +1,551 @@
+import codecs
 import json
 import boto3
 import time
 import os
 from datetime import datetime
 import redis
+from botocore.config import Config
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 
-def lambda_handler(event, context):
+from adaptive_throttle import (
+    ADAPTIVE_THROTTLE_ENABLED, AdaptiveThrottleExceeded, acquire_bedrock_slot, is_throttling_error,
+    release_bedrock_slot
+)
+from bookkeeping import join_background, run_in_background
+from concurrency_limiter import CONCURRENCY_LEASE_TTL, acquire_concurrency_slot, release_concurrency_slot
+from rate_limiter import (
+    RATE_LIMIT_QUEUE_MAX_WAIT, TPM_OUTPUT_RESERVE, blocked_rate_limit, check_rate_limit_queued, estimate_tokens,
+    jittered_retry_after, reconcile_tokens
+)
+from latency_histogram import record_latency
+from near_duplicate import find_similar_response, index_similar_response
+from request_cost import request_cost
+from response_cache import (
+    CACHE_COALESCED, CACHE_SIMILAR, CACHE_STALE, get_cached_response, is_stale_if_error, set_cached_response
+)
+from single_flight import SINGLE_FLIGHT_WAIT, is_coalescable, join_flight, leave_flight, publish_flight_result
+from usage import flush_usage, log_queue_delay, log_response_metrics, record_usage
+
+# 유휴 연결 health check 주기(초)와 연결 오류 시 재시도 횟수
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+REDIS_RETRIES = int(os.environ.get('REDIS_RETRIES', 2))
+# 연결/명령 timeout(초): 재시도마다 다시 적용되므로 명령 하나의 최악 지연은
+# (REDIS_RETRIES + 1) x (연결 + 명령 timeout) 으로 약 9초이며 Lambda timeout(30초) 안에 503 을 반환한다
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 1))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 2))
+
+# Bedrock Agent Runtime 클라이언트 설정
+BEDROCK_REGION = os.environ.get('BEDROCK_REGION') or os.environ.get('AWS_REGION', 'us-east-1')
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.environ.get('BEDROCK_MAX_POOL_CONNECTIONS', 10))
+BEDROCK_TCP_KEEPALIVE = os.environ.get('BEDROCK_TCP_KEEPALIVE', 'true').lower() == 'true'
+BEDROCK_CONNECT_TIMEOUT = float(os.environ.get('BEDROCK_CONNECT_TIMEOUT', 2))
+BEDROCK_READ_TIMEOUT = float(os.environ.get('BEDROCK_READ_TIMEOUT', 20))
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', 3))
+# Bedrock 호출에 쓸 수 있는 최대 시간(초): Lambda timeout(30초)에서 Redis 처리와 stale 대체, 슬롯/락 반환 시간을 뺀 값
+# botocore 는 ReadTimeoutError 도 재시도하므로 시도 횟수는 시도당 최악 지연(연결 + 읽기 timeout)이 이 안에 들어가도록 줄인다
+BEDROCK_CALL_BUDGET = float(os.environ.get('BEDROCK_CALL_BUDGET', 24))
+
+# warm 컨테이너에서 재사용되는 클라이언트 (get_redis_client / get_bedrock_agent_client 에서 지연 생성)
+_redis_client = None
+_bedrock_agent_client = None
+
+# 응답 출처 (Bedrock 호출 결과만 캐시 저장과 TPM 정산 대상, 도중에 실패한 스트림은 정산만)
+SOURCE_BEDROCK = 'bedrock'
+SOURCE_PARTIAL = 'partial'
+SOURCE_CACHE = 'cache'
+SOURCE_STALE = 'stale'
+
+def lambda_handler(event, context, stream=None):
+    """
+    프록시 요청 처리
+
+    stream 은 응답 스트리밍 서버(stream_server.py)에서 전달하는 ResponseStream 으로, 주어지면 SSE 요청의
+    프레임을 생성되는 즉시 보낸다. 스트림이 시작된 뒤의 반환값은 사용되지 않는다.
+    """
     print(event)
+    started = time.time()
     try:
         # API Key 또는 사용자 식별
         api_key = get_api_key(event)
         if not api_key:
             return error_response(401, "API Key required")
         
+        # 제한 초과로 거부된 키는 다음 허용 가능 시점까지 Redis 연결 없이 바로 거부 (대기 가능하면 대기)
+        queue_wait = queue_wait_timeout(context)
+        blocked = blocked_rate_limit(api_key)
+        if blocked and blocked['retry_after'] > queue_wait:
+            return rate_limit_response(blocked)
+
         # Redis 연결
         redis_conn = get_redis_client()
         
-        # 유량 제어 검사
-        rate_limit_result = check_rate_limit(redis_conn, api_key)
+        # 유량 제어 검사 (입력 토큰 추정치를 TPM 예산에서 함께 예약, 요청 크기에 따른 비용만큼 소비)
+        agent_request = parse_agent_request(event)
+        input_tokens = estimate_tokens(agent_request['inputText'])
+        weight = request_cost(redis_conn, agent_request, input_tokens)
+        rate_limit_result = check_rate_limit_queued(redis_conn, api_key, queue_wait,
+                                                    tokens=input_tokens + TPM_OUTPUT_RESERVE,
+                                                    agent_id=agent_request['agentId'], weight=weight)
+
+        # 응답 결정과 무관한 Redis 기록은 Bedrock 호출과 동시에 실행하고 응답 반환 전에 완료를 기다림
+        tasks = []
+        if rate_limit_result['queue_delay']:
+            tasks.append(run_in_background(log_queue_delay, redis_conn, api_key,
+                                           rate_limit_result['queue_delay'], rate_limit_result['allowed']))
         if not rate_limit_result['allowed']:
-            return error_response(429, "Rate limit exceeded", {
-                'X-Rate-Limit-Remaining': '0',
-                'X-Rate-Limit-Reset': str(rate_limit_result['reset_time'])
-            })
+            join_background(tasks)
+            return rate_limit_response(rate_limit_result)
         print('rate_limit check success')
         
-        # 사용량 기록
-        log_usage(redis_conn, api_key)
-        print('log_usage success')
+        # 동시 요청 제한 (응답을 반환하거나 오류로 종료되면 슬롯 반환)
+        concurrency = acquire_concurrency_slot(redis_conn, api_key, concurrency_lease_ttl(context))
+        if not concurrency['acquired']:
+            tasks.append(run_in_background(reconcile_tokens, redis_conn, api_key, rate_limit_result, 0))
+            join_background(tasks)
+            return error_response(429, "Concurrent request limit exceeded", {
+                'X-Concurrency-Limit': str(concurrency['limit'])
+            })
 
-        # Bedrock Agent 호출
-        response = invoke_bedrock_agent(event)
-        print(response)
-        
-        # 응답 후 추가 메트릭 기록
-        # log_response_metrics(redis_conn, api_key, response)
-        # print('log_response_metrics success')
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'X-Rate-Limit-Remaining': str(rate_limit_result['remaining']),
-                'X-Rate-Limit-Reset': str(rate_limit_result['reset_time'])
-            },
-            'body': json.dumps(response)
-        }
+        try:
+            # 사용량 기록 (fused 모드에서는 admission 스크립트에서 이미 기록됨, 지연 기록이면 컨테이너에 모아 둠)
+            if not rate_limit_result.get('usage_logged'):
+                tasks.append(run_in_background(record_usage, redis_conn, api_key))
+
+            return serve_agent_request(redis_conn, event, context, api_key, agent_request,
+                                       rate_limit_result, input_tokens, tasks, started, stream)
+        finally:
+            tasks.append(run_in_background(release_concurrency_slot, redis_conn, api_key, concurrency['slot']))
+            # 응답 생성 후 임계값을 넘은 지연 사용량 기록
+            tasks.append(run_in_background(flush_usage, redis_conn))
+            join_background(tasks)
         
     except redis.RedisError as e:
         print(f"Redis error: {str(e)}")
         return error_response(503, "Service temporarily unavailable")
     except Exception as e:
         print(f"Error: {str(e)}")
+        if isinstance(e.__cause__, AdaptiveThrottleExceeded):
+            return error_response(503, "Bedrock capacity exceeded, retry later", {'Retry-After': '1'})
         return error_response(500, "Internal server error")
 
+def serve_agent_request(redis_conn, event, context, api_key, agent_request, rate_limit_result, input_tokens, tasks,
+                        started, stream=None):
+    """
+    유량 제어를 통과한 요청 처리: 캐시 조회, Bedrock Agent 호출, 캐시 저장, TPM 정산
+
+    캐시 저장과 TPM 정산은 tasks 에 백그라운드 작업으로 추가되며 호출한 쪽에서 완료를 기다린다.
+    """
+    # 응답 캐시 조회 (캐시 적중도 사용량에는 기록됨)
+    cached_text, cache_status, stale_text = get_cached_response(redis_conn, agent_request)
+    extra_headers = {}
+
+    # 정확히 일치하는 캐시가 없으면 MinHash LSH 로 유사 프롬프트의 응답 조회
+    if cached_text is None:
+        similar_text, similarity = find_similar_response(redis_conn, agent_request)
+        if similar_text is not None:
+            cached_text, cache_status = similar_text, CACHE_SIMILAR
+            extra_headers['X-Cache-Similarity'] = f"{similarity:.3f}"
+
+    # 동일 프롬프트를 다른 요청이 호출 중이면 그 결과를 기다림 (single-flight)
+    flight = None
+    if cached_text is None and is_coalescable(agent_request):
+        cached_text, flight = join_flight(redis_conn, agent_request, flight_wait_timeout(context))
+        if cached_text is not None:
+            cache_status = CACHE_COALESCED
+
+    response_headers = {
+        'X-Rate-Limit-Remaining': str(rate_limit_result['remaining']),
+        'X-Rate-Limit-Reset': str(rate_limit_result['reset_time']),
+        'X-Cache': cache_status,
+        **extra_headers
+    }
+    if rate_limit_result.get('tpm_remaining', -1) >= 0:
+        response_headers['X-Token-Limit-Remaining'] = str(rate_limit_result['tpm_remaining'])
+    if rate_limit_result.get('cost', 1) > 1:
+        response_headers['X-Rate-Limit-Cost'] = str(rate_limit_result['cost'])
+    if rate_limit_result.get('queue_delay'):
+        response_headers['X-Rate-Limit-Queue-Delay'] = f"{rate_limit_result['queue_delay']:.3f}"
+
+    outcome = {}
+    try:
+        # SSE 응답: completion 조각을 chunk 이벤트로 전달 (stream 이 있으면 도착하는 대로, 없으면 모아서 반환)
+        if wants_stream(event):
+            result = stream_response(agent_request, response_headers, cached_text, stale_text, outcome, stream)
+        else:
+            result = agent_response(agent_request, response_headers, cached_text, stale_text, outcome)
+    finally:
+        tasks.append(run_in_background(finish_agent_request, redis_conn, agent_request, outcome, flight))
+
+        # 실제 Bedrock 사용 토큰으로 TPM 예약량 정산 (도중에 실패한 스트림은 생성된 부분만큼,
+        # 캐시 응답이나 Bedrock 호출 실패/거부는 예약 반환)
+        actual_tokens = 0
+        if outcome.get('source') in (SOURCE_BEDROCK, SOURCE_PARTIAL):
+            actual_tokens = input_tokens + estimate_tokens(outcome['text'])
+        tasks.append(run_in_background(reconcile_tokens, redis_conn, api_key, rate_limit_result, actual_tokens))
+
+    # 응답 메트릭/지연 히스토그램 기록 (본문 크기는 이미 직렬화된 본문으로 계산)
+    latency = time.time() - started
+    body_bytes = result['streamedBytes'] if 'streamedBytes' in result else body_size(result['body'])
+    tasks.append(run_in_background(log_response_metrics, redis_conn, api_key, body_bytes,
+                                   latency, outcome.get('chunks', 0)))
+    tasks.append(run_in_background(record_latency, redis_conn, api_key, agent_request['agentId'], {
+        'total': latency,
+        'ttfc': outcome.get('ttfc'),
+        'bedrock': outcome.get('bedrock_time')
+    }))
+
+    return result
+
 def get_redis_client():
-    """Redis 클라이언트 연결 (연결 풀 사용)"""
-    redis_host = os.environ.get('REDIS_HOST')
-    redis_port = int(os.environ.get('REDIS_PORT', 6379))
-    
-    redis_client = redis.Redis(
-        host=redis_host,
-        port=redis_port,
-        ssl=True,
-        decode_responses=True,
-        socket_connect_timeout=10,
-        socket_timeout=10,
-        retry_on_timeout=True,
-        max_connections=5
-    )
-
-    # 연결 테스트
-    redis_client.ping()
-    print("redis connection established")
-
-    return redis_client
+    """Redis 클라이언트 연결 (연결 풀 사용)
+
+    연결 풀은 모듈 전역으로 한 번만 생성되어 warm 컨테이너의 호출 간에 재사용된다.
+    매 호출마다 PING 하지 않고 health_check_interval 이 지난 유휴 연결만 검사하며,
+    끊어진 소켓은 Retry 정책에 따라 재연결 후 명령을 다시 실행한다.
+    """
+    global _redis_client
+
+    if _redis_client is None:
+        redis_host = os.environ.get('REDIS_HOST')
+        redis_port = int(os.environ.get('REDIS_PORT', 6379))
+
+        pool = redis.ConnectionPool(
+            connection_class=redis.SSLConnection,
+            host=redis_host,
+            port=redis_port,
+            decode_responses=True,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_keepalive=True,
+            retry_on_timeout=True,
+            retry=Retry(ExponentialBackoff(cap=0.5, base=0.01), REDIS_RETRIES),
+            retry_on_error=[redis.ConnectionError],
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            max_connections=5
+        )
+        _redis_client = redis.Redis(connection_pool=pool)
+        print("redis connection pool created")
+
+    return _redis_client
+
+def get_bedrock_agent_client():
+    """Bedrock Agent Runtime 클라이언트 (컨테이너당 한 번 생성)
+
+    엔드포인트 해석과 서비스 모델 로딩은 최초 1회만 수행되고,
+    VPC 엔드포인트로의 HTTPS 연결은 botocore 연결 풀에서 keepalive 로 재사용된다.
+    """
+    global _bedrock_agent_client
+
+    if _bedrock_agent_client is None:
+        config = Config(
+            region_name=BEDROCK_REGION,
+            max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+            tcp_keepalive=BEDROCK_TCP_KEEPALIVE,
+            connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+            read_timeout=BEDROCK_READ_TIMEOUT,
+            retries=bedrock_retry_config()
+        )
+        _bedrock_agent_client = boto3.client('bedrock-agent-runtime', config=config)
+        print(f"bedrock agent client created region={BEDROCK_REGION}")
+
+    return _bedrock_agent_client
+
+def bedrock_retry_config():
+    """
+    Bedrock 클라이언트 재시도 설정
+
+    시도 횟수는 BEDROCK_CALL_BUDGET 안에 들어가는 만큼으로 제한한다 (기본 timeout 이면 재시도 없음).
+    계정 전체 적응 제어가 켜져 있으면 스로틀링이 클라이언트 재시도에 가려지지 않고 바로 윈도우 조정에
+    반영되도록 재시도하지 않는다.
+    """
+    if ADAPTIVE_THROTTLE_ENABLED:
+        return {'mode': 'standard', 'total_max_attempts': 1}
+    attempts = int(BEDROCK_CALL_BUDGET // (BEDROCK_CONNECT_TIMEOUT + BEDROCK_READ_TIMEOUT))
+    return {'mode': 'adaptive', 'total_max_attempts': max(1, min(BEDROCK_MAX_ATTEMPTS, attempts))}
 
 def get_api_key(event):
     """API Key 추출"""
     headers = event.get('headers', {})
-    return headers.get('x-api-key') or headers.get('Authorization', '').replace('Bearer ', '')
+    authorization = headers.get('Authorization', headers.get('authorization', ''))
+    return headers.get('x-api-key') or authorization.replace('Bearer ', '')
 
-def check_rate_limit(redis_conn, api_key):
-    """
-    Redis를 사용한 유량 제어 (Sliding Window Counter)
-    """
-    current_time = int(time.time())
-    window_size = 60  # 1분 윈도우
-    max_requests = get_rate_limit_for_user(redis_conn, api_key)  # 사용자별 제한
-    
-    # Redis key
-    key = f"rate_limit:{{{api_key}}}:{current_time // window_size}"
-    
-    try:
-        with redis_conn.pipeline() as pipe:
-            # 트랜잭션 시작
-            pipe.multi()
-            
-            # 현재 카운트 증가
-            pipe.incr(key)
-            
-            # TTL 설정 (윈도우 크기의 2배)
-            pipe.expire(key, window_size * 2)
-            
-            # 실행
-            results = pipe.execute()
-            current_count = results[0]
-            
-            # 이전 윈도우도 확인 (더 정확한 sliding window)
-            prev_key = f"rate_limit:{api_key}:{(current_time // window_size) - 1}"
-            prev_count = redis_conn.get(prev_key) or 0
-            prev_count = int(prev_count)
-            
-            # 현재 시간이 윈도우에서 차지하는 비율
-            window_start = (current_time // window_size) * window_size
-            elapsed_ratio = (current_time - window_start) / window_size
-            
-            # 가중 평균으로 요청 수 계산
-            estimated_count = int(prev_count * (1 - elapsed_ratio) + current_count)
-            print(f"estimated_count={estimated_count} max_requests={max_requests}")
-            
-            if estimated_count > max_requests:
-                # 초과한 경우 현재 요청 취소
-                redis_conn.decr(key)
-                return {
-                    'allowed': False,
-                    'remaining': 0,
-                    'reset_time': window_start + window_size
-                }
-            
-            return {
-                'allowed': True,
-                'remaining': max(0, max_requests - estimated_count),
-                'reset_time': window_start + window_size
-            }
-            
-    except Exception as e:
-        print(f"Rate limit check error: {str(e)}")
-        # Redis 오류시 기본적으로 허용 (fallback)
-        return {'allowed': True, 'remaining': max_requests, 'reset_time': current_time + window_size}
-
-def get_rate_limit_for_user(redis_conn, api_key):
-    # 캐시에서 사용자 등급 조회
-    user_tier_key = f"user_tier:{api_key}"
-    user_tier = redis_conn.get(user_tier_key) or 'free'
-    
-    # 등급별 제한
-    rate_limits = {
-        'free': 5,      # 분당 10개
-        'premium': 60,   # 분당 60개
-        'enterprise': 300 # 분당 300개
+def parse_agent_request(event):
+    """요청 본문에서 Bedrock Agent 호출 파라미터 추출"""
+    body = event.get('body', {})
+
+    agent_id = body.get('agentId')
+    agent_alias_id = body.get('agentAliasId', 'TSTALIASID')
+    session_id = body.get('sessionId', f"session-{int(time.time())}")
+    input_text = body.get('inputText', '')
+
+    if not agent_id or not input_text:
+        raise ValueError("agentId and inputText are required")
+
+    return {
+        'agentId': agent_id,
+        'agentAliasId': agent_alias_id,
+        'sessionId': session_id,
+        'inputText': input_text,
+        'explicitSession': 'sessionId' in body
     }
-    
-    return rate_limits.get(user_tier, 10)
 
-def log_usage(redis_conn, api_key):
-    """사용량 기록 (다양한 시간 단위)"""
-    current_time = int(time.time())
-    current_date = datetime.utcnow().strftime('%Y-%m-%d')
-    current_hour = datetime.utcnow().strftime('%Y-%m-%d:%H')
-    
-    with redis_conn.pipeline() as pipe:
-        pipe.multi()
-        
-        # 해시 태그 {api_key}를 사용하여 모든 키가 같은 슬롯에 저장되도록 함
-        minute_key = f"usage:minute:{{{api_key}}}:{current_time // 60}"
-        pipe.incr(minute_key)
-        pipe.expire(minute_key, 3600)
-        
-        hour_key = f"usage:hour:{{{api_key}}}:{current_hour}"
-        pipe.incr(hour_key)
-        pipe.expire(hour_key, 86400 * 7)
-        
-        daily_key = f"usage:daily:{{{api_key}}}:{current_date}"
-        pipe.incr(daily_key)
-        pipe.expire(daily_key, 86400 * 30)
-        
-        total_key = f"usage:total:{{{api_key}}}"
-        pipe.incr(total_key)
-        
-        pipe.execute()
+def build_agent_response(agent_request, response_text):
+    """Bedrock Agent 응답 본문 생성"""
+    return {
+        'sessionId': agent_request['sessionId'],
+        'response': response_text,
+        'agentId': agent_request['agentId'],
+        'timestamp': datetime.utcnow().isoformat()
+    }
 
-def log_response_metrics(redis_conn, api_key, response):
-    """응답 메트릭 기록"""
-    current_time = int(time.time())
-    
-    # 응답 크기 계산
-    response_size = len(json.dumps(response).encode('utf-8'))
-    
-    with redis_conn.pipeline() as pipe:
-        pipe.multi()
-        
-        # 응답 크기 누적
-        size_key = f"metrics:response_size:{api_key}"
-        pipe.incrby(size_key, response_size)
-        pipe.expire(size_key, 86400)  # 1일 보관
-        
-        # 성공 카운트
-        success_key = f"metrics:success:{api_key}:{current_time // 3600}"
-        pipe.incr(success_key)
-        pipe.expire(success_key, 86400 * 7)  # 7일 보관
-        
-        pipe.execute()
+def stream_bedrock_agent_bytes(agent_request, timings=None):
+    """
+    Bedrock Agent 호출 후 completion 스트림의 원시 바이트 조각을 도착하는 대로 반환
+
+    계정 전체 적응 제어가 켜져 있으면 공유 윈도우에서 슬롯을 받아 호출하고,
+    스로틀링 여부와 첫 chunk 까지의 지연을 윈도우 조정에 반영한다.
+    스트림을 끝까지 받으면 timings 에 첫 chunk 까지의 지연(ttfc)과 전체 호출 시간(bedrock_time)을 기록한다.
+    """
+    redis_conn = get_redis_client()
+    slot = acquire_bedrock_slot(redis_conn)
+    started = time.time()
+    throttled, latency = False, None
 
-def invoke_bedrock_agent(event):
-    """Bedrock Agent 호출"""
     try:
-        body = event.get('body', {})
-        
-        agent_id = body.get('agentId')
-        agent_alias_id = body.get('agentAliasId', 'TSTALIASID')
-        session_id = body.get('sessionId', f"session-{int(time.time())}")
-        input_text = body.get('inputText', '')
-        
-        if not agent_id or not input_text:
-            raise ValueError("agentId and inputText are required")
-        
-        # Bedrock Agent 클라이언트
-        bedrock_agent = boto3.client('bedrock-agent-runtime', region_name='us-east-1')
+        bedrock_agent = get_bedrock_agent_client()
         response = bedrock_agent.invoke_agent(
-            agentId=agent_id,
-            agentAliasId=agent_alias_id,
-            sessionId=session_id,
-            inputText=input_text
+            agentId=agent_request['agentId'],
+            agentAliasId=agent_request['agentAliasId'],
+            sessionId=agent_request['sessionId'],
+            inputText=agent_request['inputText']
         )
-        
-        # 스트리밍 응답 처리
-        result = ""
+
         for event in response.get('completion', []):
             if 'chunk' in event:
                 chunk = event['chunk']
                 if 'bytes' in chunk:
-                    result += chunk['bytes'].decode('utf-8')
-        
-        return {
-            'sessionId': session_id,
-            'response': result,
-            'agentId': agent_id,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        
+                    if latency is None:
+                        latency = time.time() - started
+                    yield chunk['bytes']
+
+        if timings is not None:
+            timings.update(ttfc=latency, bedrock_time=time.time() - started)
     except Exception as e:
-        raise Exception(f"Bedrock Agent invocation failed: {str(e)}")
+        throttled = is_throttling_error(e)
+        raise
+    finally:
+        release_bedrock_slot(redis_conn, slot, throttled, latency)
+
+def stream_bedrock_agent(agent_request, timings=None):
+    """
+    Bedrock Agent completion 텍스트 조각을 도착하는 대로 반환
+
+    chunk 경계에서 잘린 멀티바이트 문자(한글은 3바이트)는 증분 디코더에 남겨 두었다가
+    다음 chunk 와 합쳐 디코딩하므로 UnicodeDecodeError 가 발생하지 않는다.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    for data in stream_bedrock_agent_bytes(agent_request, timings):
+        text = decoder.decode(data)
+        if text:
+            yield text
+
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+def invoke_bedrock_agent(agent_request, outcome=None):
+    """Bedrock Agent 호출 (outcome 에 completion chunk 수와 Bedrock 지연 기록)"""
+    try:
+        # 스트리밍 응답 처리: 바이트를 모아 마지막에 한 번만 디코딩 (응답 길이에 선형)
+        buffer = bytearray()
+        chunks = 0
+        for data in stream_bedrock_agent_bytes(agent_request, outcome):
+            buffer += data
+            chunks += 1
+
+        if outcome is not None:
+            outcome['chunks'] = chunks
+
+        return build_agent_response(agent_request, buffer.decode('utf-8'))
+
+    except Exception as e:
+        raise Exception(f"Bedrock Agent invocation failed: {str(e)}") from e
+
+def agent_response(agent_request, headers, cached_text=None, stale_text=None, outcome=None):
+    """
+    JSON 응답
+
+    cached_text 가 없으면 Bedrock Agent 를 호출하고, 스로틀링/타임아웃/5xx 로 실패하면
+    만료된 캐시 응답(stale_text)으로 대체한다. outcome 에 응답 텍스트와 출처를 기록한다.
+    """
+    if cached_text is not None:
+        response, source = build_agent_response(agent_request, cached_text), SOURCE_CACHE
+    else:
+        try:
+            response, source = invoke_bedrock_agent(agent_request, outcome), SOURCE_BEDROCK
+        except Exception as e:
+            if stale_text is None or not is_stale_if_error(e):
+                raise
+            print(f"Serving stale response: {str(e)}")
+            response, source = build_agent_response(agent_request, stale_text), SOURCE_STALE
+            headers = {**headers, 'X-Cache': CACHE_STALE}
+    print(response)
+
+    if outcome is not None:
+        outcome.update(text=response['response'], source=source)
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', **headers},
+        'body': json.dumps(response)
+    }
+
+def store_agent_response(redis_conn, agent_request, response_text, flight=None):
+    """Bedrock 응답을 응답 캐시/유사 프롬프트 캐시에 저장하고 대기 중인 single-flight follower 에게 발행"""
+    set_cached_response(redis_conn, agent_request, response_text)
+    index_similar_response(redis_conn, agent_request, response_text)
+    if flight:
+        publish_flight_result(redis_conn, flight, response_text)
+
+def finish_agent_request(redis_conn, agent_request, outcome, flight=None):
+    """Bedrock 응답 저장 후 single-flight 락 해제 (follower 가 결과를 먼저 볼 수 있도록 순서대로 실행)"""
+    try:
+        if outcome.get('source') == SOURCE_BEDROCK:
+            store_agent_response(redis_conn, agent_request, outcome['text'], flight)
+    finally:
+        if flight:
+            leave_flight(redis_conn, flight)
+
+def concurrency_lease_ttl(context):
+    """동시 요청 슬롯 임대 시간 (남은 Lambda 실행 시간 + 여유)"""
+    if context is None:
+        return CONCURRENCY_LEASE_TTL
+    return context.get_remaining_time_in_millis() / 1000 + 5
+
+def queue_wait_timeout(context):
+    """유량 제어 대기 허용 시간 (남은 Lambda 실행 시간의 절반 이내)"""
+    if context is None:
+        return RATE_LIMIT_QUEUE_MAX_WAIT
+    return min(RATE_LIMIT_QUEUE_MAX_WAIT, context.get_remaining_time_in_millis() / 1000 / 2)
+
+def flight_wait_timeout(context):
+    """follower 대기 시간 (남은 Lambda 실행 시간의 절반 이내)"""
+    if context is None:
+        return SINGLE_FLIGHT_WAIT
+    return min(SINGLE_FLIGHT_WAIT, context.get_remaining_time_in_millis() / 1000 / 2)
+
+def wants_stream(event):
+    """SSE 형식 응답 요청 여부 (Accept 헤더 또는 body.stream)"""
+    headers = event.get('headers', {})
+    if 'text/event-stream' in headers.get('accept', headers.get('Accept', '')):
+        return True
+    return bool(event.get('body', {}).get('stream'))
+
+def sse_event(name, data):
+    """Server-Sent Events 프레임 생성"""
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_agent_events(agent_request, cached_text=None, stale_text=None, outcome=None):
+    """
+    Bedrock Agent 응답을 SSE 프레임으로 변환하는 생성기
+
+    chunk 이벤트는 completion 조각마다 만들어지고, 마지막 done 이벤트에 세션 메타데이터가 담긴다.
+    cached_text 가 주어지면 Bedrock 호출 없이 하나의 chunk 로 보내고, 정상 완료 시
+    outcome 에 전체 응답 텍스트와 출처를 기록한다. 첫 chunk 전에 Bedrock 이 스로틀링/타임아웃/5xx 로
+    실패하면 stale_text 를 대신 보내고 done 이벤트에 stale 로 표시하며, 대체할 응답이 없으면 JSON 응답과
+    같이 예외를 전달하여 오류 상태 코드(500, 적응 제어 초과는 503)로 응답한다.
+    첫 chunk 이후의 오류는 error 이벤트로 전달된다.
+    """
+    texts = [cached_text] if cached_text is not None else stream_bedrock_agent(agent_request, outcome)
+    parts = []
+    stale = False
+
+    try:
+        for text in texts:
+            parts.append(text)
+            yield sse_event('chunk', {'text': text})
+    except Exception as e:
+        print(f"Bedrock Agent stream error: {str(e)}")
+        if parts:
+            # 이미 생성된 부분은 TPM 정산에 반영하되 캐시에는 저장하지 않음
+            if outcome is not None:
+                outcome.update(text=''.join(parts), source=SOURCE_PARTIAL, chunks=len(parts))
+            yield sse_event('error', {'error': "Bedrock Agent invocation failed"})
+            return
+        if stale_text is None or not is_stale_if_error(e):
+            raise Exception(f"Bedrock Agent invocation failed: {str(e)}") from e
+        stale = True
+        parts.append(stale_text)
+        yield sse_event('chunk', {'text': stale_text})
+
+    if outcome is not None:
+        source = SOURCE_STALE if stale else SOURCE_CACHE if cached_text is not None else SOURCE_BEDROCK
+        outcome.update(text=''.join(parts), source=source, chunks=len(parts) if source == SOURCE_BEDROCK else 0)
+
+    done = {
+        'sessionId': agent_request['sessionId'],
+        'agentId': agent_request['agentId'],
+        'chunkCount': len(parts),
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    if stale:
+        done['cache'] = CACHE_STALE
+    yield sse_event('done', done)
+
+def stream_response(agent_request, headers, cached_text=None, stale_text=None, outcome=None, stream=None):
+    """
+    SSE 응답
+
+    stream 이 주어지면 (Function URL RESPONSE_STREAM 으로 배포된 stream_server.py) 첫 프레임이 만들어질 때
+    상태 코드와 헤더를 보내고 각 프레임을 생성 즉시 전달한다. 첫 chunk 전의 실패는 예외로 전달되어
+    오류 응답이 되고, 그 이후의 실패는 error 이벤트로 스트림을 끝낸다.
+    stream 이 없으면 (API Gateway 프록시 통합) 전체 생성이 끝난 뒤 프레임을 모은 본문을 반환하며,
+    도중에 실패하면 JSON 응답과 같이 오류 상태 코드로 응답하도록 예외를 발생시킨다.
+    """
+    headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', **headers}
+    outcome = {} if outcome is None else outcome
+
+    if stream is None:
+        body = ''.join(stream_agent_events(agent_request, cached_text, stale_text, outcome))
+        if outcome.get('source') == SOURCE_PARTIAL:
+            raise Exception("Bedrock Agent invocation failed after first chunk")
+        return {'statusCode': 200, 'headers': headers, 'body': body}
+
+    streamed_bytes = 0
+    for frame in stream_agent_events(agent_request, cached_text, stale_text, outcome):
+        if not stream.started:
+            stream.start(200, headers)
+        stream.write(frame)
+        streamed_bytes += body_size(frame)
+
+    return {'statusCode': 200, 'headers': headers, 'body': '', 'streamedBytes': streamed_bytes}
+
+def body_size(body):
+    """응답 본문 바이트 수 (JSON 본문은 ASCII 이므로 다시 인코딩하지 않고 길이로 계산)"""
+    return len(body) if body.isascii() else len(body.encode('utf-8'))
+
+def rate_limit_response(rate_limit_result):
+    """유량 제어 거부 응답 (429)"""
+    message = "Rate limit exceeded"
+    if rate_limit_result.get('deny_reason') == 'tokens':
+        message = "Token rate limit exceeded"
+    elif rate_limit_result.get('deny_level') == 'org':
+        message = "Organization rate limit exceeded"
+    elif rate_limit_result.get('deny_level') == 'agent':
+        message = "Agent rate limit exceeded"
+    headers = {
+        'X-Rate-Limit-Remaining': '0',
+        'X-Rate-Limit-Reset': str(rate_limit_result['reset_time']),
+        'X-Rate-Limit-Scope': rate_limit_result.get('deny_level', 'key')
+    }
+    if rate_limit_result.get('retry_after', -1) >= 0:
+        headers['Retry-After'] = str(jittered_retry_after(rate_limit_result['retry_after']))
+    if rate_limit_result.get('queue_delay'):
+        headers['X-Rate-Limit-Queue-Delay'] = f"{rate_limit_result['queue_delay']:.3f}"
+    return error_response(429, message, headers)
 
 def error_response(status_code, message, additional_headers=None):
     """에러 응답"""
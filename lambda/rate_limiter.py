@@ -0,0 +1,759 @@
+import json
+import math
+import os
+import random
+import time
+
+import redis
+
+from usage import usage_updates
+
+# 등급별 분당 요청 제한
+RATE_LIMITS = {
+    'free': 5,        # 분당 5개
+    'premium': 60,    # 분당 60개
+    'enterprise': 300 # 분당 300개
+}
+DEFAULT_RATE_LIMIT = 10
+WINDOW_SIZE = 60  # 1분 윈도우
+
+# two_stage: admission 후 log_usage 를 별도 파이프라인으로 실행
+# fused: 허용된 요청의 사용량 카운터를 admission 스크립트 안에서 함께 증가 (Redis 왕복 1회)
+RATE_LIMIT_MODE = os.environ.get('RATE_LIMIT_MODE', 'two_stage')
+
+# 유량 제어 엔진 (등급별 선택, 예: {"enterprise": "sliding_log"})
+#   sliding_window: 현재/이전 윈도우 카운터 가중 평균 (기존 방식)
+#   fixed_window:   윈도우 카운터 1개
+#   gcra:           키 1개에 TAT(이론적 도착 시간) 하나만 저장
+#   token_bucket:   burst 용량을 갖는 토큰 버킷 (해시 1개)
+#   sliding_log:    sorted set 에 요청 시각을 기록하는 정확한 sliding log (고가 등급용)
+LIMITER_ENGINES = ('sliding_window', 'fixed_window', 'gcra', 'token_bucket', 'sliding_log')
+DEFAULT_RATE_LIMIT_ENGINE = os.environ.get('RATE_LIMIT_ENGINE', 'sliding_window')
+RATE_LIMIT_ENGINES = json.loads(os.environ.get('RATE_LIMIT_ENGINES', '{}'))
+
+# 등급별 burst 용량 (gcra, token_bucket), 기본값은 분당 제한과 동일
+RATE_LIMIT_BURSTS = json.loads(os.environ.get('RATE_LIMIT_BURSTS', '{}'))
+
+# 분당 토큰 제한 (TPM), 등급별 설정 가능 (예: {"enterprise": 100000}), 0 이면 검사하지 않음
+TPM_LIMIT = int(os.environ.get('TPM_LIMIT', 0))
+TPM_LIMITS = json.loads(os.environ.get('TPM_LIMITS', '{}'))
+# 입력 토큰 외에 admission 시 미리 예약할 출력 토큰 수
+TPM_OUTPUT_RESERVE = int(os.environ.get('TPM_OUTPUT_RESERVE', 0))
+
+# 할당량 임대 (등급별 임대 단위, 예: {"enterprise": 10})
+# warm 컨테이너가 한 번의 admission 으로 여러 요청분을 확보해 두고 Redis 없이 로컬에서 허용한다.
+# 임대분은 확보 시점에 전역 카운터에 반영되므로 전역 제한을 넘지 않으며, 만료 시 남은 양은 반환한다.
+# TPM 을 검사하는 등급은 요청마다 토큰을 예약해야 하므로 임대하지 않는다. TPM_LIMIT 를 전역으로 설정했다면
+# 임대 등급은 TPM_LIMITS 에서 0 으로 재정의해야 임대된다 (예: {"enterprise": 0}, 해당 등급은 요청 수로만 제한).
+RATE_LIMIT_LEASE_SIZES = json.loads(os.environ.get('RATE_LIMIT_LEASE_SIZES', '{}'))
+RATE_LIMIT_LEASE_TTL = float(os.environ.get('RATE_LIMIT_LEASE_TTL', 5))
+
+# 상위 단계 분당 요청 제한 (sliding window 카운터), 0 이면 검사하지 않음
+# 조직: key_org:{api_key} 에 저장된 조직 ID 기준으로 소속 API Key 전체의 요청 합산 (예: {"acme": 600})
+# Agent: agentId 별로 모든 API Key 의 요청 합산 (예: {"GBEBGHJOE1": 1000})
+# 조직이나 Agent 제한이 적용되는 요청은 임대하지 않는다.
+DEFAULT_ORG_RATE_LIMIT = int(os.environ.get('DEFAULT_ORG_RATE_LIMIT', 0))
+ORG_RATE_LIMITS = json.loads(os.environ.get('ORG_RATE_LIMITS', '{}'))
+DEFAULT_AGENT_RATE_LIMIT = int(os.environ.get('DEFAULT_AGENT_RATE_LIMIT', 0))
+AGENT_RATE_LIMITS = json.loads(os.environ.get('AGENT_RATE_LIMITS', '{}'))
+
+# 요청 수 제한으로 거부된 키의 차단 캐시 (가장 싼 요청도 허용될 수 없는 동안 Redis 판정 없이 바로 거부)
+# 컨테이너 로컬 캐시는 항상 사용하고, RATE_LIMIT_BLOCK_SHARED 이면 Redis 차단 표시로 다른 컨테이너와 공유한다.
+RATE_LIMIT_BLOCK_SHARED = os.environ.get('RATE_LIMIT_BLOCK_SHARED', 'false').lower() == 'true'
+RATE_LIMIT_BLOCK_CACHE_SIZE = int(os.environ.get('RATE_LIMIT_BLOCK_CACHE_SIZE', 1024))
+
+# 대기 허용 모드: 다음 허용 가능 시점이 이 시간(초) 안이면 429 대신 기다렸다가 허용 (0 이면 바로 거부)
+RATE_LIMIT_QUEUE_MAX_WAIT = float(os.environ.get('RATE_LIMIT_QUEUE_MAX_WAIT', 0))
+RATE_LIMIT_QUEUE_MARGIN = 0.01  # Redis 서버 시간과 컨테이너 시간 차이 보정(초)
+
+# 등급별 요청 비용 배율 (예: {"free": 2}), request_cost 의 가중치에 곱해 올림한 값을 소비 단위로 사용
+# 소비 단위는 엔진 용량(gcra/token_bucket 은 burst, 그 외는 분당 제한)을 넘지 않도록 제한하여, 비싼 요청도 기다리면 허용된다.
+RATE_LIMIT_COST_MULTIPLIERS = json.loads(os.environ.get('RATE_LIMIT_COST_MULTIPLIERS', '{}'))
+
+# 키별 윈도우 오프셋: 윈도우 경계를 키 해시로 0~WINDOW_SIZE 초 밀어 거부된 클라이언트의 재시도가 분 경계에 몰리지 않게 함
+# 켜거나 끈 직후 한 윈도우 동안은 이전 윈도우 카운터를 찾지 못해 제한이 느슨해진다.
+RATE_LIMIT_WINDOW_OFFSETS = os.environ.get('RATE_LIMIT_WINDOW_OFFSETS', 'false').lower() == 'true'
+# 429 응답의 Retry-After 에 더하는 무작위 지연 비율 (retry_after 의 비율, 최소 1초 범위)
+RATE_LIMIT_RETRY_JITTER = float(os.environ.get('RATE_LIMIT_RETRY_JITTER', 0.2))
+
+# 엔진별 판정당 데이터 Redis 명령 수 (등급 조회 GET 과 TIME 제외)
+ENGINE_OPS_PER_DECISION = {
+    'sliding_window': 4,  # GET x2, INCR, EXPIRE
+    'fixed_window': 3,    # GET, INCR, EXPIRE
+    'gcra': 2,            # GET, SET PX
+    'token_bucket': 3,    # HMGET, HSET, EXPIRE
+    'sliding_log': 5      # ZREMRANGEBYSCORE, ZCARD, ZRANGE, ZADD, EXPIRE
+}
+
+# 유량 제어 판정을 한 번의 EVALSHA 로 수행하는 스크립트
+# KEYS[1]: 사용자 등급 키, KEYS[2]: 유량 제어 키 prefix (엔진별 suffix 는 스크립트에서 붙임)
+# KEYS[3]: 소속 조직 키, KEYS[4]: Agent 유량 제어 키 prefix
+# KEYS[5..]: (fused 모드) 허용 시 증가시킬 사용량 카운터 키
+# ARGV[1]: 유량 제어 설정 JSON, ARGV[2]: 예약할 토큰 수 (0 이면 TPM 검사 생략),
+# ARGV[3]: Agent 분당 제한 (0 이면 검사 생략), ARGV[4]: 요청 비용 가중치,
+# ARGV[5]: (fused 모드) KEYS[5..] 별 [해시 필드 ('' 이면 INCR), TTL (0 은 만료 없음)] 목록 JSON
+# 반환: 판정 결과 JSON (allowed, remaining, reset_time, tier, limit, engine, deny_reason,
+#       deny_level, retry_after, tpm_window, tpm_remaining, cost, units, ref)
+# retry_after: 거부 시 같은 요청이 허용되는 가장 이른 시점까지 남은 시간(초), 허용될 수 없으면 -1
+#
+# 단일 샤드(cluster mode 비활성화) Redis 전용: 조직 카운터 키(rate_limit:org:{조직}:...)는 KEYS[3] 으로 조회한
+# 조직으로 스크립트 안에서 만들며, KEYS 도 등급/조직 키, API Key, Agent 별로 서로 다른 해시 슬롯에 있다.
+# 등급·조직 조회와 모든 단계의 판정·증가를 한 번의 원자적 호출로 처리하기 위한 것으로, Redis Cluster 에서는
+# CROSSSLOT 오류가 나며 조직 키를 KEYS 로 넘기려면 호출 전에 조직을 따로 조회해야 한다 (Redis 왕복 1회 추가).
+ADMISSION_SCRIPT = """
+local config = cjson.decode(ARGV[1])
+local window = config.window
+local tier = redis.call('GET', KEYS[1]) or 'free'
+local policy = config.tiers[tier] or config.default
+local cost = tonumber(ARGV[2])
+-- 이번 요청이 소비할 단위 (요청 비용 가중치 x 등급 배율, 엔진 용량 이하)
+-- min_units 는 가장 싼 요청(가중치 1)의 단위로, 이보다 비싼 요청의 거부는 키 전체를 차단하지 않는다
+local capacity = (policy.engine == 'gcra' or policy.engine == 'token_bucket') and policy.burst or policy.limit
+local request_units = math.min(capacity, math.max(1, math.ceil(tonumber(ARGV[4]) * policy.cost)))
+local min_units = math.min(capacity, math.max(1, math.ceil(policy.cost)))
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local prefix = KEYS[2]
+
+local result = {
+    tier = tier, limit = policy.limit, engine = policy.engine,
+    tpm_window = 0, tpm_remaining = -1, units = 0, ref = '', deny_reason = '', deny_level = '', retry_after = 0,
+    cost = request_units
+}
+
+-- 키 prefix 해시(djb2)로 정한 윈도우 시작 오프셋(초), 키마다 윈도우 경계를 달리하여 재시도가 분 경계에 몰리지 않게 함
+local function window_offset(name)
+    if not config.window_offsets then
+        return 0
+    end
+    local h = 5381
+    for i = 1, #name do
+        h = (h * 33 + string.byte(name, i)) % 4294967296
+    end
+    return h % window
+end
+
+-- now 가 속한 윈도우 ID 와 시작 시각
+local function window_of(offset)
+    local window_id = math.floor((now - offset) / window)
+    return window_id, window_id * window + offset
+end
+
+local key_offset = window_offset(prefix)
+
+-- sliding window 카운터에 cost 를 더해도 limit 을 넘지 않게 되는 가장 이른 시각 (불가능하면 -1)
+local function sliding_retry_at(prev, current, cost, limit, window_start)
+    if cost > limit then
+        return -1
+    end
+    if current + cost <= limit then
+        -- 이전 윈도우 가중치가 줄어들면 허용
+        return window_start + window * (1 - (limit - current - cost) / prev)
+    end
+    -- 다음 윈도우에서는 현재 카운터가 이전 윈도우 카운터가 됨
+    return window_start + window * (2 - (limit - cost) / current)
+end
+
+local function deny(reset_time, deny_reason, deny_level, retry_at)
+    result.allowed, result.remaining, result.reset_time = 0, 0, reset_time
+    result.deny_reason, result.deny_level = deny_reason, deny_level
+    result.retry_after = retry_at < 0 and -1 or math.max(0, retry_at - now)
+    return cjson.encode(result)
+end
+
+-- 다른 컨테이너에서 요청 수 제한으로 거부된 키는 차단 표시가 만료될 때까지 바로 거부
+if config.block_shared then
+    local blocked_reset = redis.call('GET', prefix .. 'blocked')
+    if blocked_reset then
+        local blocked_ms = math.max(0, redis.call('PTTL', prefix .. 'blocked'))
+        return deny(tonumber(blocked_reset), 'requests', 'key', now + blocked_ms / 1000)
+    end
+end
+
+-- 토큰 예산 (TPM): 요청 수 판정 전에 읽기만 하므로 거부 시 상태 변경 없음
+local tpm_key = nil
+if cost > 0 and policy.tpm > 0 then
+    local tpm_window, window_start = window_of(key_offset)
+    tpm_key = prefix .. 'tpm:' .. tpm_window
+    local current = tonumber(redis.call('GET', tpm_key) or '0')
+    local prev = tonumber(redis.call('GET', prefix .. 'tpm:' .. (tpm_window - 1)) or '0')
+    local used = math.floor(prev * (1 - (now - window_start) / window) + current)
+    result.tpm_window = tpm_window
+    if used + cost > policy.tpm then
+        result.tpm_remaining = 0
+        local retry_at = sliding_retry_at(prev, current, cost, policy.tpm, window_start)
+        return deny(window_start + window, 'tokens', 'key', retry_at)
+    end
+    result.tpm_remaining = policy.tpm - used - cost
+end
+
+-- 상위 단계 (조직, Agent): sliding window 카운터를 읽기만 하고, 모든 단계가 허용하면 마지막에 증가
+-- 조직 키는 KEYS 에 선언되지 않으므로 단일 샤드 Redis 에서만 사용할 수 있음
+local levels = {}
+local org = redis.call('GET', KEYS[3])
+if org then
+    local org_limit = tonumber(config.orgs[org] or config.org_default)
+    if org_limit > 0 then
+        levels[#levels + 1] = {name = 'org', prefix = 'rate_limit:org:{' .. org .. '}:', limit = org_limit}
+    end
+end
+local agent_limit = tonumber(ARGV[3])
+if agent_limit > 0 then
+    levels[#levels + 1] = {name = 'agent', prefix = KEYS[4], limit = agent_limit}
+end
+
+local level_remaining = nil
+for _, level in ipairs(levels) do
+    local window_id, window_start = window_of(window_offset(level.prefix))
+    level.window_id = window_id
+    local current = tonumber(redis.call('GET', level.prefix .. window_id) or '0')
+    local prev = tonumber(redis.call('GET', level.prefix .. (window_id - 1)) or '0')
+    local estimated = math.floor(prev * (1 - (now - window_start) / window) + current + request_units)
+    if estimated > level.limit then
+        local retry_at = sliding_retry_at(prev, current, request_units, level.limit, window_start)
+        return deny(window_start + window, 'requests', level.name, retry_at)
+    end
+    level_remaining = math.min(level_remaining or level.limit, level.limit - estimated)
+end
+
+-- 각 엔진은 units 만큼 소비를 시도하고 (allowed, remaining, reset_time, ref) 를 반환한다
+-- 거부 시에는 상태를 변경하지 않고 ref 대신 다음 허용 가능 시각을 함께 반환하며 (0, 0, reset_time, '', retry_at),
+-- ref 는 임대 반환 시 소비한 위치를 찾는 데 쓰인다
+local engines = {}
+
+engines.sliding_window = function(p, units)
+    local window_id, window_start = window_of(key_offset)
+    local reset_time = window_start + window
+    local current_key = prefix .. window_id
+    local current = tonumber(redis.call('GET', current_key) or '0')
+    local prev = tonumber(redis.call('GET', prefix .. (window_id - 1)) or '0')
+
+    -- 이번 요청을 포함한 가중 평균 요청 수
+    local elapsed_ratio = (now - window_start) / window
+    local estimated = math.floor(prev * (1 - elapsed_ratio) + current + units)
+    if estimated > p.limit then
+        return 0, 0, reset_time, '', sliding_retry_at(prev, current, units, p.limit, window_start)
+    end
+
+    redis.call('INCRBY', current_key, units)
+    redis.call('EXPIRE', current_key, window * 2)
+    return 1, p.limit - estimated, reset_time, tostring(window_id)
+end
+
+engines.fixed_window = function(p, units)
+    local window_id, window_start = window_of(key_offset)
+    local reset_time = window_start + window
+    local key = prefix .. window_id
+    local count = tonumber(redis.call('GET', key) or '0') + units
+    if count > p.limit then
+        return 0, 0, reset_time, '', units > p.limit and -1 or reset_time
+    end
+
+    redis.call('INCRBY', key, units)
+    redis.call('EXPIRE', key, window * 2)
+    return 1, p.limit - count, reset_time, tostring(window_id)
+end
+
+engines.gcra = function(p, units)
+    local key = prefix .. 'gcra'
+    local interval = window / p.limit
+    local tolerance = interval * p.burst
+    local tat = math.max(tonumber(redis.call('GET', key) or '0'), now)
+    local new_tat = tat + interval * units
+    local allow_at = new_tat - tolerance
+    if now < allow_at then
+        return 0, 0, math.ceil(allow_at), '', units * interval > tolerance and -1 or allow_at
+    end
+
+    redis.call('SET', key, string.format('%.6f', new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+    return 1, math.floor((now - allow_at) / interval), math.ceil(new_tat), ''
+end
+
+engines.token_bucket = function(p, units)
+    local key = prefix .. 'bucket'
+    local rate = p.limit / window
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or p.burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(p.burst, tokens + (now - ts) * rate)
+    if tokens < units then
+        local retry_at = units > p.burst and -1 or now + (units - tokens) / rate
+        return 0, 0, math.ceil(now + (units - tokens) / rate), '', retry_at
+    end
+
+    tokens = tokens - units
+    redis.call('HSET', key, 'tokens', string.format('%.6f', tokens), 'ts', string.format('%.6f', now))
+    redis.call('EXPIRE', key, math.ceil(p.burst / rate) + 1)
+    return 1, math.floor(tokens), math.ceil(now + (p.burst - tokens) / rate), ''
+end
+
+engines.sliding_log = function(p, units)
+    local key = prefix .. 'log'
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local reset_time = math.ceil((tonumber(oldest[2]) or now) + window)
+    if count + units > p.limit then
+        if units > p.limit then
+            return 0, 0, reset_time, '', -1
+        end
+        -- 초과분만큼 오래된 요청이 윈도우를 벗어나면 허용
+        local freed = redis.call('ZRANGE', key, count + units - p.limit - 1, count + units - p.limit - 1, 'WITHSCORES')
+        return 0, 0, reset_time, '', tonumber(freed[2]) + window
+    end
+
+    local ref = t[1] .. '.' .. t[2]
+    local members = {}
+    for i = 1, units do
+        members[#members + 1] = now
+        members[#members + 1] = ref .. ':' .. i
+    end
+    redis.call('ZADD', key, unpack(members))
+    redis.call('EXPIRE', key, window)
+    return 1, p.limit - count - units, reset_time, ref
+end
+
+-- 임대 등급은 임대 단위를 한 번에 확보하고, 부족하면 이번 요청분만 확보
+local units = request_units
+if tpm_key == nil and #levels == 0 and policy.lease > request_units then
+    units = policy.lease
+end
+local allowed, remaining, reset_time, ref, retry_at = engines[policy.engine](policy, units)
+if allowed == 0 and units > request_units then
+    units = request_units
+    allowed, remaining, reset_time, ref, retry_at = engines[policy.engine](policy, units)
+end
+
+if allowed == 0 then
+    -- 가장 싼 요청도 허용될 수 없는 다음 허용 가능 시각까지 다른 컨테이너에서도 바로 거부
+    if config.block_shared and request_units <= min_units and retry_at > now then
+        redis.call('SET', prefix .. 'blocked', reset_time, 'PX', math.ceil((retry_at - now) * 1000))
+    end
+    return deny(reset_time, 'requests', 'key', retry_at)
+end
+result.allowed, result.remaining, result.reset_time = allowed, remaining, reset_time
+result.units, result.ref = units, ref
+
+for _, level in ipairs(levels) do
+    local key = level.prefix .. level.window_id
+    redis.call('INCRBY', key, request_units)
+    redis.call('EXPIRE', key, window * 2)
+end
+if level_remaining and level_remaining < remaining then
+    result.remaining = level_remaining
+end
+
+if tpm_key then
+    redis.call('INCRBY', tpm_key, cost)
+    redis.call('EXPIRE', tpm_key, window * 2)
+end
+if #KEYS >= 5 then
+    local updates = cjson.decode(ARGV[5])
+    for i = 5, #KEYS do
+        local field, ttl = updates[i - 4][1], updates[i - 4][2]
+        if field == '' then
+            redis.call('INCR', KEYS[i])
+        else
+            redis.call('HINCRBY', KEYS[i], field, 1)
+        end
+        if ttl > 0 then
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+    end
+end
+return cjson.encode(result)
+"""
+
+# 사용하지 않은 임대분을 엔진별로 되돌리는 스크립트
+# KEYS[1]: 유량 제어 키 prefix
+# ARGV[1]: 엔진, ARGV[2]: 반환 단위, ARGV[3]: 임대 ref, ARGV[4]: 윈도우 크기, ARGV[5]: 제한, ARGV[6]: burst
+RETURN_LEASE_SCRIPT = """
+local prefix = KEYS[1]
+local engine = ARGV[1]
+local units = tonumber(ARGV[2])
+local ref = ARGV[3]
+local window = tonumber(ARGV[4])
+local limit = tonumber(ARGV[5])
+local burst = tonumber(ARGV[6])
+
+if engine == 'sliding_window' or engine == 'fixed_window' then
+    local key = prefix .. ref
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('DECRBY', key, units)
+    end
+elseif engine == 'gcra' then
+    local key = prefix .. 'gcra'
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local tat = tonumber(redis.call('GET', key) or '0') - window / limit * units
+    if tat > now then
+        redis.call('SET', key, string.format('%.6f', tat), 'PX', math.ceil((tat - now) * 1000))
+    else
+        redis.call('DEL', key)
+    end
+elseif engine == 'token_bucket' then
+    local key = prefix .. 'bucket'
+    local tokens = tonumber(redis.call('HGET', key, 'tokens'))
+    if tokens then
+        redis.call('HSET', key, 'tokens', string.format('%.6f', math.min(burst, tokens + units)))
+    end
+elseif engine == 'sliding_log' then
+    local key = prefix .. 'log'
+    for i = 1, units do
+        redis.call('ZREM', key, ref .. ':' .. i)
+    end
+end
+return units
+"""
+
+_admission_script = None
+_return_lease_script = None
+_limiter_config = None
+_limiter_policies = None
+
+# 컨테이너 로컬 임대 상태 (api_key -> 임대 정보)
+_leases = {}
+
+# 컨테이너 로컬 차단 캐시 (api_key -> (차단 만료 시각, reset_time))
+_blocked = {}
+
+
+def _get_admission_script(redis_conn):
+    """admission 스크립트 등록 (EVALSHA, NOSCRIPT 시 자동 재로딩)"""
+    global _admission_script
+    if _admission_script is None:
+        _admission_script = redis_conn.register_script(ADMISSION_SCRIPT)
+    return _admission_script
+
+
+def _policy(limit, engine, burst, tpm, lease, cost):
+    if engine not in LIMITER_ENGINES:
+        raise ValueError(f"Unknown rate limit engine: {engine}")
+    return {'limit': limit, 'engine': engine, 'burst': burst or limit, 'tpm': tpm, 'lease': lease, 'cost': cost}
+
+
+def get_limiter_config():
+    """스크립트에 전달할 등급별 유량 제어 설정 JSON (컨테이너당 한 번 생성)"""
+    global _limiter_config, _limiter_policies
+    if _limiter_config is None:
+        _limiter_policies = {
+            'window': WINDOW_SIZE,
+            'block_shared': RATE_LIMIT_BLOCK_SHARED,
+            'window_offsets': RATE_LIMIT_WINDOW_OFFSETS,
+            'org_default': DEFAULT_ORG_RATE_LIMIT,
+            'orgs': ORG_RATE_LIMITS,
+            'default': _policy(DEFAULT_RATE_LIMIT, DEFAULT_RATE_LIMIT_ENGINE, None, TPM_LIMIT, 0, 1),
+            'tiers': {
+                tier: _policy(
+                    limit,
+                    RATE_LIMIT_ENGINES.get(tier, DEFAULT_RATE_LIMIT_ENGINE),
+                    RATE_LIMIT_BURSTS.get(tier),
+                    TPM_LIMITS.get(tier, TPM_LIMIT),
+                    RATE_LIMIT_LEASE_SIZES.get(tier, 0),
+                    RATE_LIMIT_COST_MULTIPLIERS.get(tier, 1)
+                )
+                for tier, limit in RATE_LIMITS.items()
+            }
+        }
+        _limiter_config = json.dumps(_limiter_policies)
+    return _limiter_config
+
+
+def agent_rate_limit(agent_id):
+    """agentId 의 분당 요청 제한 (0 이면 제한 없음)"""
+    if agent_id is None:
+        return 0
+    return int(AGENT_RATE_LIMITS.get(agent_id, DEFAULT_AGENT_RATE_LIMIT))
+
+
+def window_offset(prefix):
+    """유량 제어 키 prefix 의 윈도우 시작 오프셋(초), admission 스크립트의 window_offset 과 같은 계산"""
+    if not RATE_LIMIT_WINDOW_OFFSETS:
+        return 0
+    h = 5381
+    for byte in prefix.encode('utf-8'):
+        h = (h * 33 + byte) % 4294967296
+    return h % WINDOW_SIZE
+
+
+def jittered_retry_after(retry_after):
+    """
+    Retry-After 헤더 값(초)
+
+    같은 시점에 거부된 클라이언트들이 동시에 재시도하지 않도록 다음 허용 가능 시점 이후로
+    retry_after 의 RATE_LIMIT_RETRY_JITTER 비율(최소 1초) 범위에서 무작위로 분산한다.
+    """
+    spread = max(1.0, retry_after * RATE_LIMIT_RETRY_JITTER) if RATE_LIMIT_RETRY_JITTER > 0 else 0
+    return math.ceil(retry_after + random.uniform(0, spread))
+
+
+def engine_profile(engine, limit):
+    """
+    엔진별 활성 키당 Redis 메모리 추정치(바이트)와 판정당 Redis 명령 수
+
+    메모리는 Redis 7 64비트 기준 키 1개(dictEntry, 키 sds, 값 객체, expires 항목)를 약 90바이트로
+    본 추정치이며, 실제 값은 bench/bench_limiter_engines.py 로 MEMORY USAGE 를 측정한다.
+    """
+    key_bytes = 90
+    if engine in ('sliding_window', 'fixed_window'):
+        keys = 2  # 윈도우 경계 직후에는 이전 윈도우 키가 함께 남아 있음
+        memory = keys * key_bytes
+    elif engine == 'gcra':
+        keys = 1
+        memory = key_bytes
+    elif engine == 'token_bucket':
+        keys = 1
+        memory = key_bytes + 40  # listpack 해시 필드 2개
+    elif engine == 'sliding_log':
+        keys = 1
+        # zset-max-listpack-entries(128) 이하는 listpack, 초과 시 skiplist + dict
+        per_entry = 30 if limit <= 128 else 100
+        memory = key_bytes + per_entry * limit
+    else:
+        raise ValueError(f"Unknown rate limit engine: {engine}")
+
+    return {
+        'engine': engine,
+        'keys': keys,
+        'memory_bytes': memory,
+        'ops_per_decision': ENGINE_OPS_PER_DECISION[engine]
+    }
+
+
+def estimate_tokens(text):
+    """
+    텍스트 토큰 수 추정
+
+    한글/CJK 등 UTF-8 3바이트 문자는 문자당 약 1토큰, 그 외는 4문자당 1토큰으로 본다.
+    UTF-8 인코딩 길이로 3바이트 문자 수를 근사하여 문자 단위 순회 없이 계산한다.
+    """
+    wide = (len(text.encode('utf-8')) - len(text)) // 2
+    return max(1, wide + math.ceil((len(text) - wide) / 4))
+
+
+def blocked_rate_limit(api_key):
+    """차단 캐시에 있는 키면 거부 결과, 없거나 차단이 만료되었으면 None"""
+    blocked = _blocked.get(api_key)
+    if blocked is None:
+        return None
+    until, reset_time = blocked
+    now = time.time()
+    if now >= until:
+        del _blocked[api_key]
+        return None
+
+    print(f"rate_limit blocked until={until:.3f}")
+    return {
+        'allowed': False,
+        'remaining': 0,
+        'reset_time': reset_time,
+        'usage_logged': False,
+        'deny_reason': 'requests',
+        'deny_level': 'key',
+        'retry_after': until - now
+    }
+
+
+def _block(api_key, reset_time, retry_after):
+    """
+    거부된 키를 다음 허용 가능 시점(retry_after 초 후)까지 차단 캐시에 등록
+
+    가득 차면 만료된 항목부터 정리한다.
+    """
+    now = time.time()
+    if len(_blocked) >= RATE_LIMIT_BLOCK_CACHE_SIZE:
+        for key in [key for key, (until, _) in _blocked.items() if until <= now]:
+            del _blocked[key]
+        if len(_blocked) >= RATE_LIMIT_BLOCK_CACHE_SIZE:
+            del _blocked[next(iter(_blocked))]
+    _blocked[api_key] = (now + retry_after, reset_time)
+
+
+def request_units(tier, weight):
+    """등급 배율을 적용한 요청 소비 단위, 엔진 용량 이하 (admission 스크립트와 같은 계산)"""
+    get_limiter_config()
+    policy = _limiter_policies['tiers'].get(tier, _limiter_policies['default'])
+    capacity = policy['burst'] if policy['engine'] in ('gcra', 'token_bucket') else policy['limit']
+    return min(capacity, max(1, math.ceil(weight * policy['cost'])))
+
+
+def admit_from_lease(redis_conn, api_key, weight=1):
+    """
+    로컬 임대에서 요청 비용만큼 허용, 임대가 없거나 부족/만료되면 None
+
+    남은 임대분보다 비용이 큰 요청이 오거나 임대가 만료되면 남은 양을 Redis 에 반환한다.
+    """
+    lease = _leases.get(api_key)
+    if lease is None:
+        return None
+
+    units = request_units(lease['tier'], weight)
+    if lease['units'] >= units and time.time() < lease['expires_at']:
+        lease['units'] -= units
+        print(f"rate_limit allowed from lease units_left={lease['units']}")
+        return {
+            'allowed': True,
+            'remaining': lease['remaining'],
+            'reset_time': lease['reset_time'],
+            'usage_logged': False,
+            'cost': units,
+            'leased': True
+        }
+
+    del _leases[api_key]
+    if lease['units'] > 0:
+        return_lease(redis_conn, api_key, lease)
+    return None
+
+
+def return_lease(redis_conn, api_key, lease):
+    """사용하지 않은 임대분 반환"""
+    global _return_lease_script
+    get_limiter_config()
+    policy = _limiter_policies['tiers'].get(lease['tier'], _limiter_policies['default'])
+    try:
+        if _return_lease_script is None:
+            _return_lease_script = redis_conn.register_script(RETURN_LEASE_SCRIPT)
+        _return_lease_script(
+            keys=[f"rate_limit:{{{api_key}}}:"],
+            args=[lease['engine'], lease['units'], lease['ref'], WINDOW_SIZE, policy['limit'], policy['burst']],
+            client=redis_conn
+        )
+    except Exception as e:
+        print(f"Lease return error: {str(e)}")
+
+
+def check_rate_limit(redis_conn, api_key, mode=None, tokens=0, agent_id=None, weight=1):
+    """
+    Redis를 사용한 유량 제어
+
+    등급 조회와 등급별 엔진의 판정, 카운터 갱신을 하나의 Lua 스크립트로 원자적으로 실행한다.
+    시간은 Redis 서버 시간을 기준으로 하므로 컨테이너 간 시계 차이가 없다.
+    fused 모드에서는 허용된 요청의 사용량 기록까지 같은 호출에서 처리하고 usage_logged 를 True 로 반환한다.
+    tokens 가 주어지면 같은 호출에서 등급별 TPM 예산을 확인하고 예약하며, 응답 후 reconcile_tokens 로 정산한다.
+    임대 등급은 한 번에 여러 요청분을 확보하여 이후 요청을 컨테이너에서 로컬로 허용한다.
+    조직과 agent_id 의 상위 단계 제한도 같은 호출에서 확인하며, 거부 시 deny_level 로
+    거부한 단계('org', 'key', 'agent')를 반환한다.
+    가장 싼 요청이 API Key 의 요청 수 제한으로 거부되면 다음 허용 가능 시점까지는 Redis 판정 없이 바로 거부한다.
+    weight 는 request_cost 로 계산한 요청 비용 가중치이며, 등급 배율을 곱해 올림한 만큼(엔진 용량 이하) 소비한다.
+    Redis 에 연결할 수 없으면 (ConnectionError, TimeoutError) 예외를 그대로 전달하며, 그 밖의 오류는 허용한다.
+    """
+    blocked = blocked_rate_limit(api_key)
+    if blocked:
+        return blocked
+
+    fused = (mode or RATE_LIMIT_MODE) == 'fused'
+    agent_limit = agent_rate_limit(agent_id)
+
+    # 유효한 임대가 남아 있으면 Redis 없이 허용 (Agent 제한이 있으면 매번 판정)
+    if not agent_limit:
+        leased = admit_from_lease(redis_conn, api_key, weight)
+        if leased:
+            return leased
+
+    try:
+        keys = [
+            f"user_tier:{api_key}",
+            f"rate_limit:{{{api_key}}}:",
+            f"key_org:{api_key}",
+            f"rate_limit:agent:{{{agent_id}}}:"
+        ]
+        args = [get_limiter_config(), tokens, agent_limit, weight]
+        if fused:
+            updates = usage_updates(api_key)
+            keys.extend(key for key, _, _ in updates)
+            args.append(json.dumps([[field or '', ttl] for _, field, ttl in updates]))
+
+        script = _get_admission_script(redis_conn)
+        decision = json.loads(script(keys=keys, args=args, client=redis_conn))
+        allowed = bool(decision['allowed'])
+        print(f"rate_limit allowed={allowed} remaining={decision['remaining']} limit={decision['limit']} "
+              f"engine={decision['engine']} cost={decision['cost']} units={decision['units']} "
+              f"tpm_remaining={decision['tpm_remaining']} deny_reason={decision['deny_reason']} "
+              f"deny_level={decision['deny_level']}")
+
+        # 가장 싼 요청의 거부만 차단 캐시에 등록 (비싼 요청의 거부로 싼 요청까지 막지 않음)
+        if (not allowed and decision['deny_level'] == 'key' and decision['deny_reason'] == 'requests'
+                and decision['retry_after'] > 0 and decision['cost'] <= request_units(decision['tier'], 1)):
+            _block(api_key, int(decision['reset_time']), decision['retry_after'])
+
+        # 이번 요청 외에 확보한 단위는 로컬 임대로 보관
+        if decision['units'] > decision['cost']:
+            _leases[api_key] = {
+                'units': decision['units'] - decision['cost'],
+                'expires_at': time.time() + RATE_LIMIT_LEASE_TTL,
+                'tier': decision['tier'],
+                'engine': decision['engine'],
+                'ref': decision['ref'],
+                'remaining': int(decision['remaining']),
+                'reset_time': int(decision['reset_time'])
+            }
+
+        return {
+            'allowed': allowed,
+            'remaining': int(decision['remaining']),
+            'reset_time': int(decision['reset_time']),
+            'usage_logged': fused and allowed,
+            'deny_reason': decision['deny_reason'],
+            'deny_level': decision['deny_level'],
+            'retry_after': decision['retry_after'],
+            'cost': int(decision['cost']),
+            'tokens_reserved': tokens if allowed and decision['tpm_remaining'] >= 0 else 0,
+            'tpm_window': int(decision['tpm_window']),
+            'tpm_remaining': int(decision['tpm_remaining'])
+        }
+
+    except (redis.ConnectionError, redis.TimeoutError):
+        # Redis 에 연결할 수 없으면 제한 없이 허용하지 않고 호출한 쪽에서 503 으로 응답
+        raise
+    except Exception as e:
+        print(f"Rate limit check error: {str(e)}")
+        # 스크립트 오류 등 그 밖의 Redis 오류시 기본적으로 허용 (fallback)
+        current_time = int(time.time())
+        return {'allowed': True, 'remaining': DEFAULT_RATE_LIMIT, 'reset_time': current_time + WINDOW_SIZE}
+
+
+def check_rate_limit_queued(redis_conn, api_key, max_wait, mode=None, tokens=0, agent_id=None, weight=1):
+    """
+    대기 허용 유량 제어
+
+    거부되더라도 엔진이 계산한 다음 허용 가능 시점(retry_after)이 max_wait 안이면 그때까지 기다린 뒤
+    다시 판정한다. 그 사이 다른 요청이 먼저 허용되면 남은 대기 시간 안에서 반복하며,
+    결과의 queue_delay 에 실제로 기다린 시간(초)을 기록한다.
+    """
+    deadline = time.time() + max_wait
+    waited = 0.0
+    while True:
+        result = check_rate_limit(redis_conn, api_key, mode, tokens, agent_id, weight)
+        result['queue_delay'] = waited
+
+        retry_after = result.get('retry_after', -1)
+        if result['allowed'] or retry_after < 0 or time.time() + retry_after > deadline:
+            return result
+
+        delay = retry_after + RATE_LIMIT_QUEUE_MARGIN
+        print(f"rate_limit queued delay={delay:.3f}")
+        time.sleep(delay)
+        waited += delay
+
+
+def reconcile_tokens(redis_conn, api_key, rate_limit_result, actual_tokens):
+    """
+    TPM 예약량 정산
+
+    admission 시 예약한 토큰과 실제 Bedrock 사용 토큰(입력+출력 추정치)의 차이를 예약한 윈도우에
+    반영한다. 캐시 응답처럼 Bedrock 을 호출하지 않은 경우 actual_tokens=0 으로 예약을 반환한다.
+    """
+    reserved = rate_limit_result.get('tokens_reserved', 0)
+    if not reserved or actual_tokens == reserved:
+        return
+
+    key = f"rate_limit:{{{api_key}}}:tpm:{rate_limit_result['tpm_window']}"
+    try:
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.incrby(key, actual_tokens - reserved)
+            pipe.expire(key, WINDOW_SIZE * 2)
+            pipe.execute()
+    except Exception as e:
+        print(f"Token reconcile error: {str(e)}")
@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+# 요청 비용 가중치 (기본 비활성화: 모든 요청 1)
+REQUEST_COST_ENABLED = os.environ.get('REQUEST_COST_ENABLED', 'false').lower() == 'true'
+# 가중치 = base + 입력 토큰 // tokens_per_unit (max 로 상한), tokens_per_unit 이 0 이면 base 만 사용
+REQUEST_COST_BASE = int(os.environ.get('REQUEST_COST_BASE', 1))
+REQUEST_COST_TOKENS_PER_UNIT = int(os.environ.get('REQUEST_COST_TOKENS_PER_UNIT', 0))
+REQUEST_COST_MAX = int(os.environ.get('REQUEST_COST_MAX', 10))
+
+# Agent 별 비용 설정 ("agentId" 또는 "agentId:agentAliasId" -> {"base", "tokens_per_unit", "max"})
+# 예: {"GBEBGHJOE1": {"base": 2, "tokens_per_unit": 1000}, "GBEBGHJOE1:PROD": {"base": 3}}
+REQUEST_COSTS = json.loads(os.environ.get('REQUEST_COSTS', '{}'))
+
+# 배포 없이 바꿀 수 있도록 Redis 해시(request_costs)에 같은 형식으로 저장된 설정이 환경 변수보다 우선하며,
+# 컨테이너에서 이 시간(초) 동안 캐시한다
+REQUEST_COST_TABLE_KEY = 'request_costs'
+REQUEST_COST_CACHE_TTL = float(os.environ.get('REQUEST_COST_CACHE_TTL', 60))
+
+_DEFAULT_COST = {'base': REQUEST_COST_BASE, 'tokens_per_unit': REQUEST_COST_TOKENS_PER_UNIT, 'max': REQUEST_COST_MAX}
+
+# 컨테이너 로컬 비용 테이블 캐시
+_cost_table = None
+_cost_table_expires_at = 0
+
+
+def get_cost_table(redis_conn):
+    """Agent 별 비용 테이블 (환경 변수 설정 + Redis 설정, 컨테이너에 캐시)"""
+    global _cost_table, _cost_table_expires_at
+
+    if _cost_table is not None and time.time() < _cost_table_expires_at:
+        return _cost_table
+
+    table = dict(REQUEST_COSTS)
+    try:
+        for name, spec in redis_conn.hgetall(REQUEST_COST_TABLE_KEY).items():
+            table[name] = json.loads(spec)
+    except Exception as e:
+        # Redis 오류나 잘못된 설정이면 이전 테이블(없으면 환경 변수 설정)을 계속 사용
+        print(f"Request cost table error: {str(e)}")
+        if _cost_table is not None:
+            table = _cost_table
+
+    _cost_table = table
+    _cost_table_expires_at = time.time() + REQUEST_COST_CACHE_TTL
+    return _cost_table
+
+
+def request_cost(redis_conn, agent_request, input_tokens):
+    """
+    요청 비용 가중치
+
+    agentId:agentAliasId, agentId 순으로 설정을 찾아 기본값에 덮어쓰고,
+    입력 토큰 수에 비례하는 가중치를 계산한다. 등급 배율은 admission 스크립트에서 곱한다.
+    """
+    if not REQUEST_COST_ENABLED:
+        return 1
+
+    table = get_cost_table(redis_conn)
+    agent_id = agent_request['agentId']
+    spec = {
+        **_DEFAULT_COST,
+        **table.get(agent_id, {}),
+        **table.get(f"{agent_id}:{agent_request['agentAliasId']}", {})
+    }
+
+    weight = spec['base']
+    if spec['tokens_per_unit'] > 0:
+        weight += input_tokens // spec['tokens_per_unit']
+    return max(1, min(weight, spec['max']))
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import time
+import unicodedata
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+
+from adaptive_throttle import AdaptiveThrottleExceeded
+
+# 응답 캐시 설정 (기본 비활성화)
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_DEFAULT_TTL = int(os.environ.get('RESPONSE_CACHE_DEFAULT_TTL', 300))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 65536))
+
+# agentId 별 TTL(초), 0 이면 해당 Agent 는 캐시하지 않음 (예: {"GBEBGHJOE1": 600})
+RESPONSE_CACHE_TTLS = json.loads(os.environ.get('RESPONSE_CACHE_TTLS', '{}'))
+
+# 만료 후 Bedrock 오류(스로틀링, 타임아웃, 5xx) 시 응답을 계속 제공하는 유예 시간(초)
+# agentId 별 설정 가능, 0 이면 stale 응답을 사용하지 않음 (예: {"GBEBGHJOE1": 3600})
+RESPONSE_CACHE_STALE_TTL = int(os.environ.get('RESPONSE_CACHE_STALE_TTL', 600))
+RESPONSE_CACHE_STALE_TTLS = json.loads(os.environ.get('RESPONSE_CACHE_STALE_TTLS', '{}'))
+
+# stale 응답으로 대체할 Bedrock 오류 코드 (5xx 응답은 코드와 무관하게 대체)
+# 호출 시 오류는 'ThrottlingException', completion 스트림 안의 오류(EventStreamError)는 'throttlingException' 처럼
+# 소문자로 시작하고 HTTP 상태 코드가 없으므로 소문자로 비교한다
+STALE_IF_ERROR_CODES = {
+    'throttlingexception',
+    'servicequotaexceededexception',
+    'toomanyrequestsexception',
+    'serviceunavailableexception',
+    'internalserverexception',
+    'dependencyfailedexception',
+    'badgatewayexception',
+    'modelnotreadyexception'
+}
+
+# X-Cache 응답 헤더 값
+CACHE_HIT = 'HIT'
+CACHE_MISS = 'MISS'
+CACHE_BYPASS = 'BYPASS'
+CACHE_COALESCED = 'COALESCED'
+CACHE_SIMILAR = 'SIMILAR'
+CACHE_STALE = 'STALE'
+
+
+def normalize_input(input_text):
+    """캐시 키용 입력 정규화 (Unicode NFC, 공백 정리)"""
+    return ' '.join(unicodedata.normalize('NFC', input_text).split())
+
+
+def prompt_hash(agent_request):
+    """(agentId, agentAliasId, 정규화된 inputText) 해시"""
+    return hashlib.sha256('\0'.join([
+        agent_request['agentId'],
+        agent_request['agentAliasId'],
+        normalize_input(agent_request['inputText'])
+    ]).encode('utf-8')).hexdigest()
+
+
+def cache_key(agent_request):
+    """프롬프트 해시 기반 캐시 키"""
+    return f"response_cache:{agent_request['agentId']}:{prompt_hash(agent_request)}"
+
+
+def cache_ttl(agent_id):
+    return int(RESPONSE_CACHE_TTLS.get(agent_id, RESPONSE_CACHE_DEFAULT_TTL))
+
+
+def stale_ttl(agent_id):
+    return int(RESPONSE_CACHE_STALE_TTLS.get(agent_id, RESPONSE_CACHE_STALE_TTL))
+
+
+def is_cacheable(agent_request):
+    """
+    캐시 대상 여부
+
+    sessionId 를 지정한 요청은 이전 대화 맥락에 따라 응답이 달라지므로 캐시하지 않는다.
+    """
+    if not RESPONSE_CACHE_ENABLED or agent_request.get('explicitSession'):
+        return False
+    return cache_ttl(agent_request['agentId']) > 0
+
+
+def get_cached_response(redis_conn, agent_request):
+    """
+    캐시된 응답 조회 -> (응답 텍스트 또는 None, 캐시 상태, stale 응답 텍스트 또는 None)
+
+    TTL 이 지났지만 유예 시간 안에 있는 응답은 MISS 로 처리하되 stale 응답으로 함께 반환하여,
+    Bedrock 호출이 일시적 오류로 실패할 때 대신 제공할 수 있게 한다.
+    """
+    if not is_cacheable(agent_request):
+        return None, CACHE_BYPASS, None
+
+    try:
+        cached, fresh_until = redis_conn.hmget(cache_key(agent_request), 'response', 'fresh_until')
+    except Exception as e:
+        print(f"Response cache get error: {str(e)}")
+        return None, CACHE_MISS, None
+
+    if cached is None:
+        return None, CACHE_MISS, None
+    if time.time() >= float(fresh_until or 0):
+        return None, CACHE_MISS, cached
+    return cached, CACHE_HIT, None
+
+
+def is_stale_if_error(error):
+    """stale 응답으로 대체할 Bedrock 오류인지 (스로틀링, 타임아웃, 5xx, 계정 동시성 윈도우 초과)"""
+    error = error.__cause__ or error
+    if isinstance(error, (HTTPClientError, BotocoreConnectionError, AdaptiveThrottleExceeded)):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code.lower() in STALE_IF_ERROR_CODES or status >= 500
+    return False
+
+
+def set_cached_response(redis_conn, agent_request, response_text):
+    """응답 저장 (크기 제한 초과 시 저장하지 않음)"""
+    if not is_cacheable(agent_request):
+        return
+    if len(response_text.encode('utf-8')) > RESPONSE_CACHE_MAX_BYTES:
+        print("Response cache skip: response too large")
+        return
+
+    ttl = cache_ttl(agent_request['agentId'])
+    key = cache_key(agent_request)
+    try:
+        # 유예 시간만큼 더 보관하고 fresh_until 로 신선도를 판단
+        with redis_conn.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={'response': response_text, 'fresh_until': int(time.time()) + ttl})
+            pipe.expire(key, ttl + stale_ttl(agent_request['agentId']))
+            pipe.execute()
+    except Exception as e:
+        print(f"Response cache set error: {str(e)}")
@@ -0,0 +1,3 @@
+#!/bin/bash
+# Lambda Web Adapter 가 실행하는 응답 스트리밍 서버 시작 스크립트
+exec python3 stream_server.py
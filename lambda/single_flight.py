@@ -0,0 +1,109 @@
+import os
+import time
+import uuid
+
+from response_cache import prompt_hash
+
+# 동일 프롬프트 동시 요청 병합 설정 (기본 비활성화)
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'false').lower() == 'true'
+SINGLE_FLIGHT_LOCK_TTL = int(os.environ.get('SINGLE_FLIGHT_LOCK_TTL', 30))      # leader 락 만료(초)
+SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get('SINGLE_FLIGHT_RESULT_TTL', 30))  # 결과 보관(초)
+SINGLE_FLIGHT_WAIT = float(os.environ.get('SINGLE_FLIGHT_WAIT', 10))           # follower 최대 대기(초)
+
+# 자신이 잡은 락만 해제하고 대기 중인 follower 를 깨움
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+redis.call('PUBLISH', KEYS[2], 'released')
+return 1
+"""
+
+_release_script = None
+
+
+def _flight_keys(agent_request):
+    digest = prompt_hash(agent_request)
+    return {
+        'lock': f"single_flight:lock:{digest}",
+        'result': f"single_flight:result:{digest}",
+        'channel': f"single_flight:channel:{digest}"
+    }
+
+
+def is_coalescable(agent_request):
+    """sessionId 를 지정한 요청은 대화 맥락이 달라 병합하지 않음"""
+    return SINGLE_FLIGHT_ENABLED and not agent_request.get('explicitSession')
+
+
+def join_flight(redis_conn, agent_request, timeout):
+    """
+    동일 프롬프트의 진행 중인 Bedrock 호출에 합류
+
+    반환값 (result_text, flight):
+      - (None, flight): 이 요청이 leader. Bedrock 호출 후 publish_flight_result, leave_flight 호출
+      - (text, None): follower. leader 가 발행한 결과 수신
+      - (None, None): 대기 시간 초과 또는 Redis 오류. 직접 Bedrock 호출
+    leader 가 결과 없이 종료하면 대기 중인 follower 중 하나가 새 leader 가 된다.
+    """
+    keys = _flight_keys(agent_request)
+    deadline = time.time() + timeout
+    pubsub = None
+
+    try:
+        while True:
+            token = uuid.uuid4().hex
+            if redis_conn.set(keys['lock'], token, nx=True, ex=SINGLE_FLIGHT_LOCK_TTL):
+                return None, dict(keys, token=token)
+
+            if pubsub is None:
+                pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(keys['channel'])
+
+            # 구독 이후 상태 확인 (구독 전에 leader 가 끝난 경우 대비)
+            while True:
+                with redis_conn.pipeline(transaction=False) as pipe:
+                    pipe.get(keys['result'])
+                    pipe.exists(keys['lock'])
+                    result, locked = pipe.execute()
+
+                if result is not None:
+                    return result, None
+                if not locked:
+                    break  # leader 가 결과 없이 종료 -> 락 획득 재시도
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    print("single flight wait timeout")
+                    return None, None
+                pubsub.get_message(timeout=min(remaining, 1.0))
+
+    except Exception as e:
+        print(f"Single flight error: {str(e)}")
+        return None, None
+
+    finally:
+        if pubsub is not None:
+            pubsub.close()
+
+
+def publish_flight_result(redis_conn, flight, response_text):
+    """leader 의 Bedrock 응답을 follower 에게 발행"""
+    try:
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.set(flight['result'], response_text, ex=SINGLE_FLIGHT_RESULT_TTL)
+            pipe.publish(flight['channel'], 'done')
+            pipe.execute()
+    except Exception as e:
+        print(f"Single flight publish error: {str(e)}")
+
+
+def leave_flight(redis_conn, flight):
+    """leader 락 해제"""
+    global _release_script
+    try:
+        if _release_script is None:
+            _release_script = redis_conn.register_script(RELEASE_SCRIPT)
+        _release_script(keys=[flight['lock'], flight['channel']], args=[flight['token']], client=redis_conn)
+    except Exception as e:
+        print(f"Single flight release error: {str(e)}")
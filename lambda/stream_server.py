@@ -0,0 +1,109 @@
+"""
+응답 스트리밍 서버
+
+Python 관리형 런타임은 핸들러 응답을 스트리밍하지 않으므로, Lambda Web Adapter(AWS_LAMBDA_EXEC_WRAPPER)가
+Function URL(InvokeMode RESPONSE_STREAM) 요청을 이 HTTP 서버로 전달하고 응답을 받는 대로 클라이언트에 흘려보낸다.
+요청 처리는 proxy_function.lambda_handler 를 그대로 사용하며, SSE 요청은 프레임을 chunked 로 바로 보낸다.
+
+실행: run.sh (Lambda), 로컬에서는 python stream_server.py
+"""
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from proxy_function import error_response, lambda_handler
+
+# Lambda Web Adapter 가 요청을 전달하는 포트
+STREAM_SERVER_PORT = int(os.environ.get('AWS_LWA_PORT', os.environ.get('PORT', 8080)))
+
+
+class ResponseStream:
+    """HTTP/1.1 chunked 응답 (start 로 상태 코드와 헤더를 보낸 뒤 write 로 프레임 전달)"""
+
+    def __init__(self, request_handler):
+        self.request_handler = request_handler
+        self.started = False
+
+    def start(self, status_code, headers):
+        handler = self.request_handler
+        handler.send_response(status_code)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        self.started = True
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        if data:
+            self.request_handler.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.request_handler.wfile.flush()
+
+    def close(self):
+        self.request_handler.wfile.write(b'0\r\n\r\n')
+        self.request_handler.wfile.flush()
+
+
+class InvocationContext:
+    """Lambda Web Adapter 가 전달한 호출 deadline 으로 남은 실행 시간을 계산하는 context"""
+
+    def __init__(self, deadline_ms):
+        self.deadline_ms = deadline_ms
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int(self.deadline_ms - time.time() * 1000))
+
+
+def invocation_context(headers):
+    """x-amzn-lambda-context 헤더의 deadline 으로 context 생성 (없으면 None)"""
+    try:
+        deadline = json.loads(headers.get('x-amzn-lambda-context', '{}')).get('deadline')
+    except ValueError:
+        deadline = None
+    return InvocationContext(deadline) if deadline else None
+
+
+class ProxyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # Lambda Web Adapter readiness check
+        self.send_full_response({'statusCode': 200, 'headers': {'Content-Type': 'text/plain'}, 'body': 'ok'})
+
+    def do_POST(self):
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        length = int(headers.get('content-length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self.send_full_response(error_response(400, "Invalid JSON body"))
+            return
+
+        stream = ResponseStream(self)
+        response = lambda_handler({'headers': headers, 'body': body}, invocation_context(headers), stream)
+        if stream.started:
+            stream.close()
+        else:
+            self.send_full_response(response)
+
+    def send_full_response(self, response):
+        data = response['body'].encode('utf-8')
+        self.send_response(response['statusCode'])
+        for name, value in response['headers'].items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', STREAM_SERVER_PORT), ProxyRequestHandler)
+    print(f"stream server listening port={STREAM_SERVER_PORT}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import calendar
+import os
+import threading
+import time
+from datetime import datetime
+
+# 사용량 저장 방식
+#   compact: API Key 별 일별 해시 1개(시간 필드 + 일 합계)와 시간별 분 단위 해시 1개
+#            (모든 해시가 기본 hash-max-listpack-entries(128) 이하라 listpack 으로 저장됨)
+#   legacy:  분/시간/일 단위마다 문자열 키 1개 (키당 약 1,500개/일 생성)
+USAGE_SCHEMA = os.environ.get('USAGE_SCHEMA', 'compact')
+
+# 보관 기간(초): 분 단위는 해당 시간 이후 1시간, 일별(시간 포함)은 30일
+USAGE_MINUTES_TTL = 7200
+USAGE_DAY_TTL = 86400 * 30
+
+# 응답 메트릭 보관 기간(초)
+RESPONSE_METRICS_TTL = 86400 * 7
+
+# 지연 기록 (write-behind, 기본 비활성화)
+# 요청마다 Redis 에 쓰지 않고 컨테이너에 사용량/메트릭 증가량을 모아 두었다가, 허용된 요청의 호출이 끝날 때
+# 모아 둔 요청 수나 가장 오래된 증가량의 경과 시간이 임계값을 넘었으면 한 번의 MULTI 파이프라인으로 기록한다.
+# 기록에 실패하면 다시 모아 두므로 최소 한 번 이상 기록된다(at-least-once).
+# 임계값은 호출 종료 시에만 확인한다(별도 타이머 없음, 호출 사이에는 컨테이너가 정지됨). 따라서
+#   - 호출이 이어지는 동안 기록 지연은 USAGE_FLUSH_INTERVAL 초 이내이지만, 호출이 끊긴 컨테이너는 다음 호출까지 기록하지 않는다.
+#   - 그대로 회수되면 마지막 기록 이후 허용된 최대 USAGE_FLUSH_MAX_PENDING - 1 건 요청의 사용량/메트릭
+#     (과 그 사이 거절된 요청의 대기 메트릭)이 유실된다. 기록 실패로 다시 모아 둔 증가량이 있으면 그보다 많을 수 있다.
+USAGE_WRITE_BEHIND = os.environ.get('USAGE_WRITE_BEHIND', 'false').lower() == 'true'
+USAGE_FLUSH_MAX_PENDING = int(os.environ.get('USAGE_FLUSH_MAX_PENDING', 50))
+USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', 10))
+
+# 기록 대기 중인 증가량 ((키, 해시 필드) -> [증가량, TTL])과 그 증가량을 남긴 요청 수
+_pending = {}
+_pending_requests = 0
+_pending_since = None
+_pending_lock = threading.Lock()
+
+
+def usage_updates(api_key, current_time=None):
+    """
+    사용량 카운터 갱신 목록 [(키, 해시 필드 또는 None, TTL)] (TTL 0 은 만료 없음)
+
+    필드가 None 이면 문자열 키 INCR, 아니면 해시 HINCRBY 로 1 증가시킨다.
+    """
+    current_time = int(current_time or time.time())
+    now = datetime.utcfromtimestamp(current_time)
+    current_date = now.strftime('%Y-%m-%d')
+
+    # 해시 태그 {api_key}를 사용하여 모든 키가 같은 슬롯에 저장되도록 함
+    if USAGE_SCHEMA == 'legacy':
+        return [
+            (f"usage:minute:{{{api_key}}}:{current_time // 60}", None, 3600),
+            (f"usage:hour:{{{api_key}}}:{now.strftime('%Y-%m-%d:%H')}", None, 86400 * 7),
+            (f"usage:daily:{{{api_key}}}:{current_date}", None, 86400 * 30),
+            (f"usage:total:{{{api_key}}}", None, 0)
+        ]
+
+    day_key = f"usage:day:{{{api_key}}}:{current_date}"
+    return [
+        (day_key, 'count', USAGE_DAY_TTL),
+        (day_key, now.strftime('%H'), USAGE_DAY_TTL),
+        (f"usage:minutes:{{{api_key}}}:{current_date}:{now.strftime('%H')}", now.strftime('%M'), USAGE_MINUTES_TTL),
+        (f"usage:total:{{{api_key}}}", None, 0)
+    ]
+
+
+def log_usage(redis_conn, api_key):
+    """사용량 기록 (다양한 시간 단위)"""
+    with redis_conn.pipeline() as pipe:
+        pipe.multi()
+
+        for key, field, ttl in usage_updates(api_key):
+            if field is None:
+                pipe.incr(key)
+            else:
+                pipe.hincrby(key, field, 1)
+            if ttl:
+                pipe.expire(key, ttl)
+
+        pipe.execute()
+
+
+def _merge_counters(counters, updates):
+    """증가량 목록 [(키, 필드, 증가량, TTL)] 을 {(키, 필드): [증가량, TTL]} 에 합산"""
+    for key, field, amount, ttl in updates:
+        counters.setdefault((key, field), [0, ttl])[0] += amount
+    return counters
+
+
+def _write_counters(redis_conn, counters):
+    """합산된 증가량을 한 번의 MULTI 파이프라인으로 기록 (필드가 None 이면 문자열 키 INCRBY)"""
+    with redis_conn.pipeline() as pipe:
+        pipe.multi()
+        for (key, field), (amount, ttl) in counters.items():
+            if field is None:
+                pipe.incrby(key, amount)
+            else:
+                pipe.hincrby(key, field, amount)
+            if ttl:
+                pipe.expire(key, ttl)
+        pipe.execute()
+
+
+def record_counters(redis_conn, updates):
+    """카운터 증가 기록 [(키, 필드, 증가량, TTL)] (지연 기록이면 컨테이너에 모아 두고, 아니면 바로 기록)"""
+    if not USAGE_WRITE_BEHIND:
+        _write_counters(redis_conn, _merge_counters({}, updates))
+        return
+
+    global _pending_since
+    with _pending_lock:
+        _merge_counters(_pending, updates)
+        if _pending_since is None:
+            _pending_since = time.time()
+
+
+def record_usage(redis_conn, api_key):
+    """사용량 기록 (지연 기록이면 컨테이너에 모아 두고, 아니면 바로 기록)"""
+    if not USAGE_WRITE_BEHIND:
+        log_usage(redis_conn, api_key)
+        return
+    record_counters(redis_conn, [(key, field, 1, ttl) for key, field, ttl in usage_updates(api_key)])
+
+
+def log_response_metrics(redis_conn, api_key, body_bytes, latency, chunks):
+    """
+    응답 메트릭 기록 (API Key 별 시간 단위 해시: 성공 수, 응답 바이트, 누적 지연 ms, Bedrock chunk 수)
+
+    사용량과 같은 경로로 기록되므로 지연 기록이면 사용량과 함께 모아서 기록된다.
+    """
+    now = datetime.utcfromtimestamp(int(time.time()))
+    key = f"metrics:response:{{{api_key}}}:{now.strftime('%Y-%m-%d:%H')}"
+    record_counters(redis_conn, [
+        (key, 'success', 1, RESPONSE_METRICS_TTL),
+        (key, 'bytes', body_bytes, RESPONSE_METRICS_TTL),
+        (key, 'latency_ms', int(latency * 1000), RESPONSE_METRICS_TTL),
+        (key, 'chunks', chunks, RESPONSE_METRICS_TTL)
+    ])
+
+
+def is_flush_due():
+    """모아 둔 요청 수나 가장 오래된 증가량의 경과 시간이 임계값을 넘었는지"""
+    if _pending_since is None:
+        return False
+    return _pending_requests >= USAGE_FLUSH_MAX_PENDING or time.time() - _pending_since >= USAGE_FLUSH_INTERVAL
+
+
+def flush_usage(redis_conn, force=False):
+    """
+    모아 둔 사용량/메트릭을 한 번의 MULTI 파이프라인으로 기록 (같은 키/필드는 합산)
+
+    허용된 요청의 호출 종료 시 한 번씩 호출되며, force 가 아니면 요청 1건을 세고 임계값을 넘었을 때만 기록한다.
+    실패하면 증가량을 다시 모아 두어 다음 기록 때 재시도한다.
+    """
+    global _pending, _pending_requests, _pending_since
+    with _pending_lock:
+        if not _pending:
+            return
+        if not force:
+            _pending_requests += 1
+            if not is_flush_due():
+                return
+        pending, count, since = _pending, _pending_requests, _pending_since
+        _pending, _pending_requests, _pending_since = {}, 0, None
+
+    try:
+        _write_counters(redis_conn, pending)
+        print(f"usage flushed requests={count} counters={len(pending)}")
+    except Exception as e:
+        print(f"Usage flush error: {str(e)}")
+        with _pending_lock:
+            for field_key, (amount, ttl) in pending.items():
+                _pending.setdefault(field_key, [0, ttl])[0] += amount
+            _pending_requests += count
+            _pending_since = min(since, _pending_since or since)
+
+
+def get_total_usage(redis_conn, api_key):
+    """누적 요청 수"""
+    return int(redis_conn.get(f"usage:total:{{{api_key}}}") or 0)
+
+
+def get_daily_usage(redis_conn, api_key, date):
+    """
+    일별 사용량 -> {'count': 일 합계, 'hours': 0~23시 요청 수 리스트}
+
+    date 는 'YYYY-MM-DD' (UTC) 형식이며, legacy 방식의 시간 단위 키는 7일만 보관된다.
+    """
+    hours = [f'{hour:02d}' for hour in range(24)]
+    if USAGE_SCHEMA == 'legacy':
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.get(f"usage:daily:{{{api_key}}}:{date}")
+            pipe.mget([f"usage:hour:{{{api_key}}}:{date}:{hour}" for hour in hours])
+            count, values = pipe.execute()
+    else:
+        count, *values = redis_conn.hmget(f"usage:day:{{{api_key}}}:{date}", 'count', *hours)
+
+    return {'count': int(count or 0), 'hours': [int(value or 0) for value in values]}
+
+
+def get_minute_usage(redis_conn, api_key, date, hour):
+    """분 단위 사용량 -> 해당 시간 0~59분 요청 수 리스트 (최근 1~2시간만 보관)"""
+    minutes = [f'{minute:02d}' for minute in range(60)]
+    if USAGE_SCHEMA == 'legacy':
+        start = calendar.timegm(datetime.strptime(f"{date} {hour:02d}", '%Y-%m-%d %H').timetuple()) // 60
+        values = redis_conn.mget([f"usage:minute:{{{api_key}}}:{start + minute}" for minute in range(60)])
+    else:
+        values = redis_conn.hmget(f"usage:minutes:{{{api_key}}}:{date}:{hour:02d}", *minutes)
+
+    return [int(value or 0) for value in values]
+
+
+def usage_memory_profile(schema, active_hours=24):
+    """
+    API Key 1개가 하루 중 active_hours 시간 동안 매분 요청할 때의 정상 상태 사용량 키 수와 메모리 추정치(바이트)
+
+    rate_limiter.engine_profile 과 같이 키 1개를 약 90바이트, listpack 해시 필드 1개를 약 12바이트로 본
+    추정치이며, 실제 값은 bench/bench_usage_memory.py 로 MEMORY USAGE 를 측정한다.
+    """
+    key_bytes = 90
+    field_bytes = 12
+    if schema == 'legacy':
+        # 분 키 1시간, 시간 키 7일, 일 키 30일, 누적 키 1개
+        keys = 60 + active_hours * 7 + 30 + 1
+        memory = keys * key_bytes
+        created_per_day = active_hours * 60 + active_hours + 1
+    elif schema == 'compact':
+        # 일별 해시 30일(시간 필드 + 합계), 최근 2시간의 분 해시, 누적 키 1개
+        minute_hashes = min(active_hours, 2)
+        keys = 30 + minute_hashes + 1
+        memory = (
+            30 * (key_bytes + (active_hours + 1) * field_bytes)
+            + minute_hashes * (key_bytes + 60 * field_bytes)
+            + key_bytes
+        )
+        created_per_day = 1 + active_hours
+    else:
+        raise ValueError(f"Unknown usage schema: {schema}")
+
+    return {'schema': schema, 'keys': keys, 'keys_created_per_day': created_per_day, 'memory_bytes': memory}
+
+
+def log_queue_delay(redis_conn, api_key, delay, admitted):
+    """대기 허용 모드 메트릭 기록 (일별 대기 횟수, 대기 후 허용 횟수, 누적 대기 시간)"""
+    current_date = datetime.utcfromtimestamp(int(time.time())).strftime('%Y-%m-%d')
+    key = f"usage:queue:{{{api_key}}}:{current_date}"
+    record_counters(redis_conn, [
+        (key, 'queued', 1, USAGE_DAY_TTL),
+        (key, 'admitted', 1 if admitted else 0, USAGE_DAY_TTL),
+        (key, 'delay_ms', int(delay * 1000), USAGE_DAY_TTL)
+    ])
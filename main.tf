@@ -197,6 +197,8 @@ resource "aws_elasticache_subnet_group" "main" {
   subnet_ids = [aws_subnet.private_a.id, aws_subnet.private_b.id]
 }
 
+# 유량 제어 admission 스크립트가 여러 해시 슬롯의 키(조직 카운터 포함)를 한 번에 다루므로
+# cluster mode 를 켜지 않은 단일 샤드로 유지해야 한다 (rate_limiter.ADMISSION_SCRIPT 참고)
 resource "aws_elasticache_replication_group" "main" {
   replication_group_id          = "bedrock-proxy-redis"
   description                   = "Redis for Bedrock proxy rate limiting"
@@ -289,6 +291,28 @@ resource "aws_iam_role_policy_attachment" "lambda_attachment" {
   policy_arn = aws_iam_policy.lambda_policy.arn
 }
 
+# 프록시 함수 공통 환경 변수 (API 함수와 응답 스트리밍 함수)
+locals {
+  proxy_environment = {
+    REDIS_HOST                = aws_elasticache_replication_group.main.primary_endpoint_address
+    REDIS_PORT                = aws_elasticache_replication_group.main.port
+    RPM_LIMIT                 = "100"
+    TPM_LIMIT                 = "10000"
+    # enterprise 는 warm 컨테이너가 10 요청분을 임대해 Redis 왕복 없이 허용한다. 임대는 요청마다 토큰을 예약하는
+    # TPM 검사와 함께 쓸 수 없으므로 enterprise 의 TPM 제한을 끄고 분당 요청 수(300)로만 제한한다.
+    # 토큰 사용량 상한이 필요하면 이 두 줄을 지워 임대 대신 TPM 을 검사한다.
+    TPM_LIMITS                = jsonencode({ enterprise = 0 })
+    RATE_LIMIT_LEASE_SIZES    = jsonencode({ enterprise = 10 })
+    RATE_LIMIT_MODE           = "two_stage"
+    BEDROCK_REGION            = var.aws_region
+    RESPONSE_CACHE_ENABLED    = "false"
+    SINGLE_FLIGHT_ENABLED     = "false"
+    NEAR_DUPLICATE_ENABLED    = "false"
+    DEFAULT_CONCURRENCY_LIMIT = "0"
+    ADAPTIVE_THROTTLE_ENABLED = "false"
+  }
+}
+
 resource "aws_lambda_function" "bedrock_proxy" {
   function_name    = "bedrock-proxy-function"
   handler          = "proxy_function.lambda_handler"
@@ -305,12 +329,7 @@ resource "aws_lambda_function" "bedrock_proxy" {
   }
 
   environment {
-    variables = {
-      REDIS_HOST      = aws_elasticache_replication_group.main.primary_endpoint_address
-      REDIS_PORT      = aws_elasticache_replication_group.main.port
-      RPM_LIMIT       = "100"
-      TPM_LIMIT       = "10000"
-    }
+    variables = local.proxy_environment
   }
 
   # VPC 엔드포인트가 생성된 후 Lambda 함수 생성
@@ -322,3 +341,47 @@ resource "aws_lambda_function" "bedrock_proxy" {
     aws_security_group_rule.lambda_to_vpc_endpoint
   ]
 }
+
+# SSE 응답 스트리밍 함수: Lambda Web Adapter 가 Function URL(RESPONSE_STREAM) 요청을 stream_server.py 로 전달하고
+# 응답을 생성되는 대로 클라이언트에 보낸다 (같은 코드와 환경 변수 사용)
+resource "aws_lambda_function" "bedrock_proxy_stream" {
+  function_name    = "bedrock-proxy-stream-function"
+  handler          = "run.sh"
+  runtime          = "python3.11"
+  role             = aws_iam_role.lambda_exec_role.arn
+  filename         = data.archive_file.lambda_zip.output_path
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+  timeout          = 30
+  layers = [
+    aws_lambda_layer_version.redis_layer.arn,
+    "arn:${data.aws_partition.current.partition}:lambda:${var.aws_region}:753240598075:layer:LambdaAdapterLayerX86:${var.lambda_adapter_layer_version}"
+  ]
+
+  vpc_config {
+    subnet_ids         = [aws_subnet.private_a.id, aws_subnet.private_b.id]
+    security_group_ids = [aws_security_group.lambda_sg.id]
+  }
+
+  environment {
+    variables = merge(local.proxy_environment, {
+      AWS_LAMBDA_EXEC_WRAPPER      = "/opt/bootstrap"
+      AWS_LWA_INVOKE_MODE          = "response_stream"
+      AWS_LWA_PORT                 = "8080"
+      AWS_LWA_READINESS_CHECK_PATH = "/"
+    })
+  }
+
+  depends_on = [
+    aws_vpc_endpoint.bedrock,
+    aws_vpc_endpoint.bedrock_runtime,
+    aws_vpc_endpoint.bedrock_agent_runtime,
+    aws_security_group_rule.lambda_to_elasticache,
+    aws_security_group_rule.lambda_to_vpc_endpoint
+  ]
+}
+
+resource "aws_lambda_function_url" "bedrock_proxy_stream" {
+  function_name      = aws_lambda_function.bedrock_proxy_stream.function_name
+  authorization_type = var.stream_url_authorization_type
+  invoke_mode        = "RESPONSE_STREAM"
+}
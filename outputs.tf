@@ -6,4 +6,7 @@ output "lambda_function_name" {
 
 output "elasticache_redis_endpoint" {
   value = aws_elasticache_replication_group.main.primary_endpoint_address
-}
\ No newline at end of file
+}
+output "stream_function_url" {
+  value = aws_lambda_function_url.bedrock_proxy_stream.function_url
+}
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+import rate_limiter  # noqa: E402
+
+
+@pytest.fixture
+def redis_conn():
+    """Lua 스크립트를 실행할 수 있는 fakeredis 연결 (lupa 필요)"""
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """
+    기본 설정으로 초기화한 rate_limiter 모듈
+
+    테스트에서 설정 상수를 바꾼 뒤에는 configure() 로 컨테이너 캐시를 다시 만든다.
+    """
+    monkeypatch.setattr(rate_limiter, 'print', lambda *args, **kwargs: None, raising=False)
+    monkeypatch.setattr(rate_limiter, 'DEFAULT_RATE_LIMIT_ENGINE', 'sliding_window')
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_ENGINES', {})
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_BURSTS', {})
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_LEASE_SIZES', {})
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_COST_MULTIPLIERS', {})
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_BLOCK_SHARED', False)
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_WINDOW_OFFSETS', False)
+    monkeypatch.setattr(rate_limiter, 'TPM_LIMIT', 0)
+    monkeypatch.setattr(rate_limiter, 'TPM_LIMITS', {})
+    monkeypatch.setattr(rate_limiter, '_blocked', {})
+    monkeypatch.setattr(rate_limiter, '_leases', {})
+    monkeypatch.setattr(rate_limiter, '_admission_script', None)
+    monkeypatch.setattr(rate_limiter, '_return_lease_script', None)
+
+    def configure(**settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(rate_limiter, name, value)
+        rate_limiter._limiter_config = None
+        rate_limiter._limiter_policies = None
+
+    rate_limiter.configure = configure
+    configure()
+    yield rate_limiter
+    del rate_limiter.configure
+    configure()
+
+
+@pytest.fixture
+def redis_down():
+    """연결할 수 없는 Redis (명령마다 ConnectionError)"""
+    server = fakeredis.FakeServer()
+    server.connected = False
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
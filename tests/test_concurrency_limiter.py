@@ -0,0 +1,13 @@
+import concurrency_limiter
+
+
+def test_short_lease_does_not_shorten_semaphore_ttl(redis_conn, monkeypatch):
+    monkeypatch.setattr(concurrency_limiter, 'DEFAULT_CONCURRENCY_LIMIT', 2)
+    monkeypatch.setattr(concurrency_limiter, 'print', lambda *args, **kwargs: None, raising=False)
+
+    long_lease = concurrency_limiter.acquire_concurrency_slot(redis_conn, 'key-1', 30)
+    short_lease = concurrency_limiter.acquire_concurrency_slot(redis_conn, 'key-1', 5)
+
+    assert long_lease['acquired'] and short_lease['acquired']
+    assert redis_conn.ttl('concurrency:{key-1}') >= 29
+    assert not concurrency_limiter.acquire_concurrency_slot(redis_conn, 'key-1', 5)['acquired']
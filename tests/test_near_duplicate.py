@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+import near_duplicate
+
+BASE_PROMPT = '겨울에 어울리는 시 한 편을 써 주세요. 눈 내리는 밤과 따뜻한 차 한 잔을 주제로 해 주세요.'
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(near_duplicate, 'NEAR_DUPLICATE_ENABLED', True)
+    monkeypatch.setattr(near_duplicate, 'print', lambda *args, **kwargs: None, raising=False)
+
+
+def agent_request(input_text, agent_id='AGENT1'):
+    return {'agentId': agent_id, 'agentAliasId': 'ALIAS1', 'inputText': input_text, 'explicitSession': False}
+
+
+def signature(text):
+    return near_duplicate.encode_signature(near_duplicate.minhash_signature(near_duplicate.shingle_hashes(text)))
+
+
+def bucket_keys(redis_conn):
+    return redis_conn.keys('near_dup:bucket:*')
+
+
+def test_shingles_ignore_punctuation_spacing_and_case():
+    assert near_duplicate.shingle_hashes('Hello, World!') == near_duplicate.shingle_hashes('hello world')
+
+
+def test_similarity_estimate_separates_near_and_unrelated_prompts():
+    base = signature(BASE_PROMPT)
+
+    assert near_duplicate.estimate_similarity(base, base) == 1.0
+    assert near_duplicate.estimate_similarity(base, signature(BASE_PROMPT.replace('써 주세요', '써줘요'))) >= 0.8
+    assert near_duplicate.estimate_similarity(base, signature('오늘 서울 날씨와 미세먼지 농도를 알려 주세요.')) < 0.2
+
+
+def test_indexed_response_is_found_for_near_duplicate(redis_conn):
+    near_duplicate.index_similar_response(redis_conn, agent_request(BASE_PROMPT), '눈 내리는 밤')
+
+    text, similarity = near_duplicate.find_similar_response(redis_conn, agent_request(BASE_PROMPT + '!'))
+
+    assert text == '눈 내리는 밤'
+    assert similarity >= near_duplicate.NEAR_DUPLICATE_THRESHOLD
+
+
+def test_unrelated_prompt_and_other_agent_miss(redis_conn):
+    near_duplicate.index_similar_response(redis_conn, agent_request(BASE_PROMPT), '눈 내리는 밤')
+
+    assert near_duplicate.find_similar_response(redis_conn, agent_request('오늘 서울 날씨를 알려 주세요.'))[0] is None
+    assert near_duplicate.find_similar_response(redis_conn, agent_request(BASE_PROMPT, 'AGENT2'))[0] is None
+
+
+def test_long_input_is_not_signed(redis_conn, monkeypatch):
+    monkeypatch.setattr(near_duplicate, 'NEAR_DUPLICATE_MAX_CHARS', 10)
+    request = agent_request(BASE_PROMPT)
+
+    near_duplicate.index_similar_response(redis_conn, request, '눈 내리는 밤')
+
+    assert near_duplicate.find_similar_response(redis_conn, request) == (None, 0.0)
+    assert 'minhashSignature' not in request
+    assert bucket_keys(redis_conn) == []
+
+
+def test_signature_is_computed_once_per_request(redis_conn, monkeypatch):
+    calls = []
+    original = near_duplicate.minhash_signature
+    monkeypatch.setattr(near_duplicate, 'minhash_signature', lambda hashes: calls.append(1) or original(hashes))
+    request = agent_request(BASE_PROMPT)
+
+    near_duplicate.find_similar_response(redis_conn, request)
+    near_duplicate.index_similar_response(redis_conn, request, '눈 내리는 밤')
+
+    assert len(calls) == 1
+
+
+def test_expired_members_are_pruned_and_ignored(redis_conn):
+    request = agent_request(BASE_PROMPT)
+    key = near_duplicate._band_keys(request, near_duplicate.request_signature(request))[0]
+    redis_conn.zadd(key, {'expired-entry': time.time() - 1})
+
+    assert near_duplicate.find_similar_response(redis_conn, request) == (None, 0.0)
+
+    near_duplicate.index_similar_response(redis_conn, request, '눈 내리는 밤')
+
+    assert redis_conn.zscore(key, 'expired-entry') is None
+    assert redis_conn.ttl(key) > 0
+
+
+def test_bucket_size_is_capped(redis_conn, monkeypatch):
+    monkeypatch.setattr(near_duplicate, 'NEAR_DUPLICATE_MAX_BUCKET', 3)
+    for i in range(5):
+        near_duplicate.index_similar_response(redis_conn, agent_request(BASE_PROMPT + ' ' * i), f'응답 {i}')
+
+    keys = bucket_keys(redis_conn)
+    assert keys and all(redis_conn.zcard(key) <= 3 for key in keys)
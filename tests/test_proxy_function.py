@@ -0,0 +1,159 @@
+import json
+import os
+
+import pytest
+
+import proxy_function
+
+EVENT_PATH = os.path.join(os.path.dirname(__file__), '..', 'test.json')
+
+
+@pytest.fixture
+def event():
+    with open(EVENT_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def stream_event(event):
+    event['headers']['Accept'] = 'text/event-stream'
+    return event
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setattr(proxy_function, 'print', lambda *args, **kwargs: None, raising=False)
+
+
+class FakeAgent:
+    """completion 스트림으로 chunks 를 보낸 뒤 error 가 있으면 발생시키는 bedrock-agent-runtime 클라이언트"""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def invoke_agent(self, **kwargs):
+        def completion():
+            for text in self.chunks:
+                yield {'chunk': {'bytes': text.encode('utf-8')}}
+            if self.error:
+                raise self.error
+        return {'completion': completion()}
+
+
+@pytest.fixture
+def bedrock(monkeypatch, limiter, redis_conn):
+    """fakeredis 와 가짜 Bedrock 클라이언트로 핸들러 실행 준비, Bedrock 응답을 설정하는 함수 반환"""
+    monkeypatch.setattr(proxy_function, '_redis_client', redis_conn)
+
+    def respond(chunks, error=None):
+        monkeypatch.setattr(proxy_function, '_bedrock_agent_client', FakeAgent(chunks, error))
+    return respond
+
+
+def tpm_used(redis_conn):
+    return sum(int(redis_conn.get(key)) for key in redis_conn.keys('rate_limit:{test}:tpm:*'))
+
+
+def test_unreachable_redis_returns_503(event, redis_down, monkeypatch):
+    monkeypatch.setattr(proxy_function, '_redis_client', redis_down)
+
+    response = proxy_function.lambda_handler(event, None)
+
+    assert response['statusCode'] == 503
+
+
+@pytest.mark.parametrize('connect, read, configured, adaptive, expected', [
+    (2, 20, 3, False, {'mode': 'adaptive', 'total_max_attempts': 1}),
+    (1, 5, 3, False, {'mode': 'adaptive', 'total_max_attempts': 3}),
+    (1, 10, 3, False, {'mode': 'adaptive', 'total_max_attempts': 2}),
+    (2, 30, 3, False, {'mode': 'adaptive', 'total_max_attempts': 1}),
+    (1, 5, 3, True, {'mode': 'standard', 'total_max_attempts': 1})
+])
+def test_bedrock_retries_fit_call_budget(monkeypatch, connect, read, configured, adaptive, expected):
+    monkeypatch.setattr(proxy_function, 'BEDROCK_CONNECT_TIMEOUT', connect)
+    monkeypatch.setattr(proxy_function, 'BEDROCK_READ_TIMEOUT', read)
+    monkeypatch.setattr(proxy_function, 'BEDROCK_MAX_ATTEMPTS', configured)
+    monkeypatch.setattr(proxy_function, 'ADAPTIVE_THROTTLE_ENABLED', adaptive)
+
+    retries = proxy_function.bedrock_retry_config()
+
+    assert retries == expected
+    if not adaptive:
+        assert retries['total_max_attempts'] * (connect + read) <= proxy_function.BEDROCK_CALL_BUDGET or \
+            retries['total_max_attempts'] == 1
+
+
+def test_failed_call_refunds_token_reservation(event, bedrock, limiter, redis_conn):
+    limiter.configure(TPM_LIMIT=10000)
+    bedrock([], RuntimeError('connection reset'))
+
+    response = proxy_function.lambda_handler(event, None)
+
+    assert response['statusCode'] == 500
+    assert tpm_used(redis_conn) == 0
+
+
+def test_stream_failure_after_first_chunk_charges_generated_tokens(stream_event, bedrock, limiter, redis_conn):
+    limiter.configure(TPM_LIMIT=10000)
+    partial = '겨울 밤' * 20
+    bedrock([partial], RuntimeError('connection reset'))
+
+    proxy_function.lambda_handler(stream_event, None)
+
+    input_tokens = limiter.estimate_tokens(stream_event['body']['inputText'])
+    assert tpm_used(redis_conn) == input_tokens + limiter.estimate_tokens(partial)
+
+
+class RecordingStream:
+    """stream_server.ResponseStream 과 같은 인터페이스로 보낸 내용을 기록"""
+
+    def __init__(self):
+        self.started = False
+        self.status_code = None
+        self.frames = []
+
+    def start(self, status_code, headers):
+        self.started = True
+        self.status_code = status_code
+
+    def write(self, text):
+        self.frames.append(text)
+
+
+def test_buffered_stream_failure_after_first_chunk_returns_500(stream_event, bedrock):
+    bedrock(['겨울 밤'], RuntimeError('connection reset'))
+
+    response = proxy_function.lambda_handler(stream_event, None)
+
+    assert response['statusCode'] == 500
+
+
+def test_response_stream_sends_frames_as_generated(stream_event, bedrock):
+    bedrock(['겨울 ', '밤'])
+    stream = RecordingStream()
+
+    proxy_function.lambda_handler(stream_event, None, stream)
+
+    assert stream.status_code == 200
+    assert [frame.split('\n')[0] for frame in stream.frames] == ['event: chunk', 'event: chunk', 'event: done']
+
+
+def test_response_stream_failure_before_first_chunk_returns_error_status(stream_event, bedrock):
+    bedrock([], RuntimeError('connection reset'))
+    stream = RecordingStream()
+
+    response = proxy_function.lambda_handler(stream_event, None, stream)
+
+    assert not stream.started
+    assert response['statusCode'] == 500
+
+
+def test_response_stream_failure_after_first_chunk_ends_with_error_event(stream_event, bedrock):
+    bedrock(['겨울 밤'], RuntimeError('connection reset'))
+    stream = RecordingStream()
+
+    proxy_function.lambda_handler(stream_event, None, stream)
+
+    assert stream.status_code == 200
+    assert stream.frames[-1].startswith('event: error')
@@ -0,0 +1,250 @@
+import pytest
+import redis
+
+
+def check(limiter, redis_conn, api_key='key-1', **kwargs):
+    return limiter.check_rate_limit(redis_conn, api_key, **kwargs)
+
+
+def set_tier(redis_conn, tier, api_key='key-1'):
+    redis_conn.set(f"user_tier:{api_key}", tier)
+
+
+def test_weight_above_limit_is_capped_and_admitted(limiter, redis_conn):
+    set_tier(redis_conn, 'free')
+
+    result = check(limiter, redis_conn, weight=10)
+
+    assert result['allowed']
+    assert result['cost'] == limiter.RATE_LIMITS['free']
+
+
+def test_expensive_denial_does_not_block_cheap_requests(limiter, redis_conn):
+    # 회귀: 비용이 제한보다 큰 요청이 거부되면 reset_time 까지 키 전체가 차단되었음
+    limiter.configure(RATE_LIMIT_BLOCK_SHARED=True)
+    set_tier(redis_conn, 'free')
+    assert check(limiter, redis_conn, weight=3)['allowed']
+
+    denied = check(limiter, redis_conn, weight=3)
+    cheap = check(limiter, redis_conn, weight=1)
+
+    assert not denied['allowed']
+    assert limiter._blocked == {}
+    assert redis_conn.get('rate_limit:{key-1}:blocked') is None
+    assert cheap['allowed']
+
+
+def test_cheap_denial_blocks_until_retry_after(limiter, redis_conn):
+    limiter.configure(RATE_LIMIT_BLOCK_SHARED=True)
+    set_tier(redis_conn, 'free')
+    for _ in range(limiter.RATE_LIMITS['free']):
+        assert check(limiter, redis_conn)['allowed']
+
+    denied = check(limiter, redis_conn)
+
+    assert not denied['allowed']
+    # 현재 윈도우가 가득 차면 다음 윈도우에서 이전 윈도우 가중치가 줄어들 때까지 기다려야 함
+    assert 0 < denied['retry_after'] <= limiter.WINDOW_SIZE * 2
+    assert 'key-1' in limiter._blocked
+    assert redis_conn.pttl('rate_limit:{key-1}:blocked') > 0
+
+
+# 윈도우를 1시간으로 늘려 테스트 도중 윈도우 경계를 넘지 않게 함
+HOUR = 3600
+LIMIT = 5
+ENGINES = ('sliding_window', 'fixed_window', 'gcra', 'token_bucket', 'sliding_log')
+
+# 제한까지 사용한 뒤 거부될 때 엔진별 retry_after 범위(초)
+RETRY_AFTER_RANGES = {
+    'sliding_window': (HOUR * 0.2 - 1, HOUR * 1.2),  # 이전 윈도우가 된 현재 카운터의 가중치가 줄어들 때
+    'fixed_window': (0, HOUR),                        # 윈도우 종료
+    'gcra': (HOUR / LIMIT - 1, HOUR / LIMIT),         # 요청 간격 1개
+    'token_bucket': (HOUR / LIMIT - 1, HOUR / LIMIT),  # 토큰 1개 보충
+    'sliding_log': (HOUR - 1, HOUR)                   # 가장 오래된 요청이 윈도우를 벗어날 때
+}
+
+
+def use_engine(limiter, engine, **settings):
+    limiter.configure(WINDOW_SIZE=HOUR, RATE_LIMITS={'free': LIMIT}, DEFAULT_RATE_LIMIT_ENGINE=engine, **settings)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_allows_up_to_limit_then_denies(limiter, redis_conn, engine):
+    use_engine(limiter, engine)
+
+    results = [check(limiter, redis_conn) for _ in range(LIMIT)]
+    denied = check(limiter, redis_conn)
+
+    assert all(result['allowed'] for result in results)
+    assert [result['remaining'] for result in results][-1] == 0
+    assert not denied['allowed']
+    assert (denied['deny_reason'], denied['deny_level']) == ('requests', 'key')
+    low, high = RETRY_AFTER_RANGES[engine]
+    assert low <= denied['retry_after'] <= high
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_keys_are_independent(limiter, redis_conn, engine):
+    use_engine(limiter, engine)
+    for _ in range(LIMIT):
+        check(limiter, redis_conn)
+
+    assert not check(limiter, redis_conn)['allowed']
+    assert check(limiter, redis_conn, api_key='key-2')['allowed']
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_consumes_request_weight(limiter, redis_conn, engine):
+    use_engine(limiter, engine)
+
+    first = check(limiter, redis_conn, weight=3)
+    too_expensive = check(limiter, redis_conn, weight=3)
+    cheap = check(limiter, redis_conn, weight=2)
+
+    assert first['allowed'] and first['cost'] == 3
+    assert not too_expensive['allowed']
+    assert too_expensive['retry_after'] > 0
+    assert cheap['allowed']
+    assert not check(limiter, redis_conn)['allowed']
+
+
+def test_cost_multiplier_applies_per_tier(limiter, redis_conn):
+    use_engine(limiter, 'fixed_window', RATE_LIMIT_COST_MULTIPLIERS={'free': 2})
+
+    results = [check(limiter, redis_conn) for _ in range(3)]
+
+    assert [result['cost'] for result in results[:2]] == [2, 2]
+    assert [result['allowed'] for result in results] == [True, True, False]
+
+
+@pytest.mark.parametrize('engine', ['gcra', 'token_bucket'])
+def test_weight_is_capped_at_burst(limiter, redis_conn, engine):
+    use_engine(limiter, engine, RATE_LIMIT_BURSTS={'free': 2})
+
+    result = check(limiter, redis_conn, weight=10)
+
+    assert result['allowed'] and result['cost'] == 2
+    assert limiter.request_units('free', 10) == 2
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_lease_admits_locally_and_returns_unused_units(limiter, redis_conn, engine):
+    use_engine(limiter, engine, RATE_LIMIT_LEASE_SIZES={'free': LIMIT})
+
+    first = check(limiter, redis_conn)
+    assert first['allowed'] and 'key-1' in limiter._leases
+    assert limiter._leases['key-1']['units'] == LIMIT - 1
+
+    # 임대분은 Redis 에서 이미 소비되었으므로 다른 컨테이너(임대 없음)는 거부됨
+    lease = limiter._leases.pop('key-1')
+    assert not check(limiter, redis_conn)['allowed']
+    limiter._blocked.clear()
+
+    limiter._leases['key-1'] = lease
+    leased = check(limiter, redis_conn)
+    assert leased['allowed'] and leased.get('leased')
+    assert limiter._leases['key-1']['units'] == LIMIT - 2
+
+    # 만료된 임대는 남은 단위를 반환한 뒤 Redis 에서 판정
+    limiter._leases['key-1']['expires_at'] = 0
+    returned = check(limiter, redis_conn)
+    assert returned['allowed'] and not returned.get('leased')
+    assert 'key-1' not in limiter._leases
+
+
+def test_lease_falls_back_to_redis_for_expensive_request(limiter, redis_conn):
+    use_engine(limiter, 'fixed_window', RATE_LIMIT_LEASE_SIZES={'free': 3})
+    check(limiter, redis_conn)
+    assert limiter._leases['key-1']['units'] == 2
+
+    result = check(limiter, redis_conn, weight=3)
+
+    # 남은 임대 2 단위를 반환하고 Redis 에서 3 단위를 새로 확보
+    assert result['allowed'] and not result.get('leased')
+    assert redis_conn.get(f"rate_limit:{{key-1}}:{int(redis_conn.time()[0]) // HOUR}") == '4'
+
+
+def test_lease_requires_tier_without_tpm(limiter, redis_conn):
+    # TPM 을 검사하는 등급은 임대하지 않으므로, 임대 등급은 TPM_LIMITS 에서 0 으로 재정의해야 함
+    use_engine(limiter, 'fixed_window', TPM_LIMIT=100, RATE_LIMIT_LEASE_SIZES={'free': 3})
+    check(limiter, redis_conn, tokens=10)
+    assert limiter._leases == {}
+
+    limiter.configure(TPM_LIMITS={'free': 0})
+    result = check(limiter, redis_conn, api_key='key-2', tokens=10)
+
+    assert result['allowed'] and result['tokens_reserved'] == 0
+    assert limiter._leases['key-2']['units'] == 2
+
+
+def test_tpm_budget_denies_with_retry_after(limiter, redis_conn):
+    use_engine(limiter, 'fixed_window', TPM_LIMIT=100)
+
+    allowed = check(limiter, redis_conn, tokens=80)
+    denied = check(limiter, redis_conn, tokens=30)
+    impossible = check(limiter, redis_conn, tokens=200)
+
+    assert allowed['allowed'] and allowed['tokens_reserved'] == 80 and allowed['tpm_remaining'] == 20
+    assert not denied['allowed'] and denied['deny_reason'] == 'tokens'
+    assert 0 < denied['retry_after'] <= HOUR * 2
+    assert not impossible['allowed'] and impossible['retry_after'] == -1
+    # 토큰 거부는 요청 수 차단 캐시에 등록하지 않음
+    assert limiter._blocked == {}
+
+
+def test_reconcile_tokens_returns_unused_reservation(limiter, redis_conn):
+    use_engine(limiter, 'fixed_window', TPM_LIMIT=100)
+    result = check(limiter, redis_conn, tokens=80)
+
+    limiter.reconcile_tokens(redis_conn, 'key-1', result, 30)
+
+    assert check(limiter, redis_conn, tokens=70)['allowed']
+
+
+@pytest.mark.parametrize('level', ['org', 'agent'])
+def test_upper_level_limit_denies_without_consuming_key(limiter, redis_conn, level):
+    if level == 'org':
+        use_engine(limiter, 'fixed_window', ORG_RATE_LIMITS={'acme': 2})
+        for api_key in ('key-1', 'key-2'):
+            redis_conn.set(f"key_org:{api_key}", 'acme')
+    else:
+        use_engine(limiter, 'fixed_window', AGENT_RATE_LIMITS={'AGENT1': 2})
+
+    results = [check(limiter, redis_conn, api_key=api_key, agent_id='AGENT1')
+               for api_key in ('key-1', 'key-2', 'key-2')]
+
+    assert [result['allowed'] for result in results] == [True, True, False]
+    assert results[2]['deny_level'] == level
+    assert results[2]['retry_after'] > 0
+    assert limiter._blocked == {}
+    assert check(limiter, redis_conn, api_key='key-3', agent_id='AGENT2')['allowed']
+
+
+def test_queued_check_waits_for_next_slot(limiter, redis_conn):
+    # 0.1초 간격, burst 1 인 gcra
+    limiter.configure(RATE_LIMITS={'free': 600}, DEFAULT_RATE_LIMIT_ENGINE='gcra', RATE_LIMIT_BURSTS={'free': 1})
+
+    first = limiter.check_rate_limit_queued(redis_conn, 'key-1', max_wait=1)
+    second = limiter.check_rate_limit_queued(redis_conn, 'key-1', max_wait=1)
+    limiter.check_rate_limit_queued(redis_conn, 'key-2', max_wait=0)
+    rejected = limiter.check_rate_limit_queued(redis_conn, 'key-2', max_wait=0)
+
+    assert first['allowed'] and first['queue_delay'] == 0
+    assert second['allowed'] and 0 < second['queue_delay'] <= 0.2
+    assert not rejected['allowed'] and rejected['queue_delay'] == 0
+
+
+def test_fused_mode_records_usage_in_admission(limiter, redis_conn):
+    use_engine(limiter, 'fixed_window')
+
+    allowed = check(limiter, redis_conn, mode='fused')
+    for _ in range(LIMIT):
+        check(limiter, redis_conn, mode='fused')
+
+    assert allowed['usage_logged']
+    assert redis_conn.get('usage:total:{key-1}') == str(LIMIT)
+
+
+def test_unreachable_redis_is_not_admitted(limiter, redis_down):
+    with pytest.raises(redis.ConnectionError):
+        check(limiter, redis_down)
@@ -0,0 +1,77 @@
+import json
+
+import botocore.session
+import pytest
+from botocore.exceptions import ClientError, EventStreamError, ReadTimeoutError
+from botocore.parsers import EventStreamJSONParser
+
+from adaptive_throttle import AdaptiveThrottleExceeded, is_throttling_error
+from response_cache import is_stale_if_error
+
+
+def client_error(code, status):
+    return ClientError({'Error': {'Code': code, 'Message': 'error'},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'InvokeAgent')
+
+
+def stream_error(exception_type):
+    """InvokeAgent completion 스트림 안에서 받은 예외 이벤트를 botocore 와 같은 방식으로 파싱"""
+    model = botocore.session.get_session().get_service_model('bedrock-agent-runtime')
+    shape = model.operation_model('InvokeAgent').output_shape.members['completion']
+    parsed = EventStreamJSONParser().parse({
+        'headers': {
+            ':message-type': 'exception',
+            ':exception-type': exception_type,
+            ':content-type': 'application/json'
+        },
+        'body': json.dumps({'message': 'error'}).encode(),
+        'status_code': 400
+    }, shape)
+    return EventStreamError(parsed, 'InvokeAgent')
+
+
+def wrapped(error):
+    """proxy_function 이 Bedrock 오류를 감싸는 방식"""
+    try:
+        raise Exception('Bedrock Agent invocation failed') from error
+    except Exception as e:
+        return e
+
+
+@pytest.mark.parametrize('error, stale', [
+    (client_error('ThrottlingException', 429), True),
+    (client_error('InternalServerException', 500), True),
+    (client_error('SomethingElse', 503), True),
+    (client_error('ValidationException', 400), False),
+    (client_error('AccessDeniedException', 403), False),
+    (ReadTimeoutError(endpoint_url='https://bedrock'), True),
+    (AdaptiveThrottleExceeded('full'), True),
+    (ValueError('bad input'), False)
+])
+def test_call_time_errors(error, stale):
+    assert is_stale_if_error(error) is stale
+    assert is_stale_if_error(wrapped(error)) is stale
+
+
+@pytest.mark.parametrize('exception_type, stale', [
+    ('throttlingException', True),
+    ('serviceQuotaExceededException', True),
+    ('internalServerException', True),
+    ('dependencyFailedException', True),
+    ('badGatewayException', True),
+    ('modelNotReadyException', True),
+    ('validationException', False),
+    ('accessDeniedException', False)
+])
+def test_in_stream_errors(exception_type, stale):
+    error = stream_error(exception_type)
+
+    assert is_stale_if_error(error) is stale
+    assert is_stale_if_error(wrapped(error)) is stale
+
+
+def test_in_stream_throttling_matches_adaptive_throttle():
+    error = stream_error('throttlingException')
+
+    assert is_throttling_error(error)
+    assert is_stale_if_error(error)
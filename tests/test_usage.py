@@ -0,0 +1,90 @@
+import pytest
+
+import usage
+
+API_KEY = 'test'
+
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    """지연 기록을 켜고 컨테이너에 모아 둔 증가량을 비운 usage 모듈"""
+    monkeypatch.setattr(usage, 'print', lambda *args, **kwargs: None, raising=False)
+    monkeypatch.setattr(usage, 'USAGE_WRITE_BEHIND', True)
+    monkeypatch.setattr(usage, 'USAGE_FLUSH_MAX_PENDING', 3)
+    monkeypatch.setattr(usage, 'USAGE_FLUSH_INTERVAL', 10)
+    monkeypatch.setattr(usage, '_pending', {})
+    monkeypatch.setattr(usage, '_pending_requests', 0)
+    monkeypatch.setattr(usage, '_pending_since', None)
+    return usage
+
+
+def serve_request(redis_conn):
+    """허용된 요청 1건이 남기는 기록 (사용량, 응답 메트릭) 후 호출 종료 시 기록 확인"""
+    usage.record_usage(redis_conn, API_KEY)
+    usage.log_response_metrics(redis_conn, API_KEY, 100, 0.5, 2)
+    usage.flush_usage(redis_conn)
+
+
+def test_records_are_written_immediately_without_write_behind(redis_conn, monkeypatch):
+    monkeypatch.setattr(usage, 'USAGE_WRITE_BEHIND', False)
+
+    usage.record_usage(redis_conn, API_KEY)
+
+    assert usage.get_total_usage(redis_conn, API_KEY) == 1
+
+
+def test_flush_waits_for_request_threshold(write_behind, redis_conn):
+    for _ in range(2):
+        serve_request(redis_conn)
+    assert usage.get_total_usage(redis_conn, API_KEY) == 0
+
+    serve_request(redis_conn)
+
+    assert usage.get_total_usage(redis_conn, API_KEY) == 3
+    assert write_behind._pending == {} and write_behind._pending_requests == 0
+
+
+def test_threshold_counts_requests_not_record_calls(write_behind, redis_conn):
+    # 요청 1건이 여러 번 기록해도 요청 수 임계값(3)에는 1건으로 센다
+    for _ in range(4):
+        usage.log_queue_delay(redis_conn, API_KEY, 0.1, True)
+    serve_request(redis_conn)
+
+    assert write_behind._pending_requests == 1
+    assert usage.get_total_usage(redis_conn, API_KEY) == 0
+
+
+def test_flush_after_interval(write_behind, redis_conn, monkeypatch):
+    serve_request(redis_conn)
+    monkeypatch.setattr(usage, '_pending_since', usage._pending_since - 10)
+
+    usage.flush_usage(redis_conn)
+
+    assert usage.get_total_usage(redis_conn, API_KEY) == 1
+
+
+def test_forced_flush_writes_merged_counters(write_behind, redis_conn):
+    serve_request(redis_conn)
+    serve_request(redis_conn)
+
+    usage.flush_usage(redis_conn, force=True)
+
+    date = next(iter(redis_conn.scan_iter('usage:day:*'))).rsplit(':', 1)[1]
+    assert usage.get_daily_usage(redis_conn, API_KEY, date)['count'] == 2
+    assert usage.get_total_usage(redis_conn, API_KEY) == 2
+
+
+def test_failed_flush_merges_counts_back(write_behind, redis_conn, redis_down):
+    for _ in range(2):
+        serve_request(redis_down)
+    since = write_behind._pending_since
+
+    serve_request(redis_down)
+    assert write_behind._pending_requests == 3
+    assert write_behind._pending_since == since
+
+    # 기록 실패 중 모인 증가량과 함께 다음 기록에서 한 번에 기록
+    serve_request(redis_conn)
+
+    assert usage.get_total_usage(redis_conn, API_KEY) == 4
+    assert write_behind._pending == {}
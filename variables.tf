@@ -3,3 +3,15 @@ variable "aws_region" {
   type        = string
   default     = "us-east-1"
 }
+
+variable "lambda_adapter_layer_version" {
+  description = "응답 스트리밍 함수에 사용할 Lambda Web Adapter 레이어(LambdaAdapterLayerX86) 버전"
+  type        = number
+  default     = 25
+}
+
+variable "stream_url_authorization_type" {
+  description = "응답 스트리밍 Function URL 인증 방식 (AWS_IAM 또는 NONE, NONE 이어도 API Key 는 함수에서 검사)"
+  type        = string
+  default     = "AWS_IAM"
+}